@@ -10,12 +10,19 @@ parent_dir = os.path.join(current_script_dir, os.pardir)
 sys.path.append(parent_dir)
 
 import time
+import queue
+import threading
+import multiprocessing
 from ftplib import FTP
 import subprocess
 from datetime import datetime, timedelta
 from concurrent.futures import ThreadPoolExecutor
 
 from config.config import aod_config
+from util.ftp_pool import FTP_session_pool, retr_resumable
+from util.file_catalog import File_catalog, file_md5
+from himawari_manifest import Himawari_manifest, utc_now
+from himawari_state import Himawari_state_store, LISTED, DOWNLOADED, PROCESSED, FAILED, MISSING, COMPLETE, ABSENT
 
 
 # --- FTP and Directory Configuration ---
@@ -30,15 +37,78 @@ PROCESS_SCRIPT = "/home/work1/projects/Air_Quality/AOD data/process_aod_data.py"
 MISSING_LOG_FILE = "/home/work1/projects/Air_Quality/AOD data/missing_data.log"
 
 # Thời gian bắt đầu lịch sử để tải về (Starting time for historical download)
+# Chỉ dùng cho lần chạy đầu tiên; sau đó tiến độ được đọc từ checkpoint trong state store
+# Mọi mốc giờ đều theo UTC như cây thư mục trên server (so sánh với utc_now(), không dùng datetime.now())
 start_time_holder = datetime(2023, 12, 4, 0, 0)
 
-# Maximum number of consecutive missing hours before considering we've caught up
-MAX_CONSECUTIVE_MISSING = 24  # If ... in a row are missing, assume we're caught up
+# --- Processing Worker Pool ---
+# Long-lived worker processes import xarray/rasterio/geopandas once and run
+# process_aod_data.process_nc_file as a function call for each downloaded file.
+PROCESS_WORKERS = 4  # 0 = fall back to one `python process_aod_data.py` subprocess per file
+PROCESS_TIMEOUT = 300  # Seconds allowed for processing a single file
+PROCESS_MAX_TASKS_PER_CHILD = 500  # Recycle workers periodically to bound memory growth
+PROCESS_POLL_INTERVAL = 1  # Seconds between checks whether another task's timeout retired the pool
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+# --- Download / Processing Pipeline ---
+# Downloaders put finished .nc paths on a bounded queue consumed by processor threads,
+# so transfers continue while files are converted. When the queue is full, downloaders
+# wait (backpressure) instead of piling up unprocessed files on disk.
+PROCESS_QUEUE_SIZE = 16
+PROCESSOR_THREADS = max(PROCESS_WORKERS, 1)  # One in-flight task per worker process
+
+_process_queue = queue.Queue(maxsize=PROCESS_QUEUE_SIZE)
+_processor_threads = []
+_processor_lock = threading.Lock()
+
+# --- Missing-Hour Retry Scheduler ---
+# Missing or failed hours are re-checked in batches with exponential backoff, so late
+# JAXA uploads are filled without rescanning history.
+RETRY_BASE_DELAY = 60 * 60  # First re-check one hour after the hour was found missing
+RETRY_MAX_DELAY = 24 * 60 * 60  # Backoff cap
+RETRY_HORIZON = timedelta(days=14)  # Still missing (absent) or with failed files (failed) this long after it was queued -> given up
+RETRY_BATCH_SIZE = 48  # Hours re-checked per run
+
+# --- Adaptive Real-Time Polling ---
+# The delay between observation time and publication is learned from the manifest.
+# Polling is fast inside the expected arrival window and backs off outside it.
+REALTIME_DEFAULT_POLL = 600  # Seconds between checks until enough arrivals are observed
+REALTIME_FAST_POLL = 60  # Inside the expected arrival window
+REALTIME_MAX_POLL = 30 * 60  # Longest wait between checks
+REALTIME_WINDOW_MARGIN = timedelta(minutes=5)  # Widens the p10-p90 arrival window
+REALTIME_LOOKBACK = timedelta(hours=2)  # Older hours are left to the retry scheduler
+
+# --- Concurrent Download Configuration ---
+FTP_MAX_CONNECTIONS = 4  # Logged-in FTP sessions kept open to the JAXA server
+HOUR_WORKERS = 4  # Hours checked in parallel during historical download
+
+
+def connect_ftp():
+    """Open and log in a new FTP session"""
+    ftp = FTP(FTP_HOST, timeout=30)
+    ftp.login(FTP_USER, FTP_PASS)
+    return ftp
+
+
+# Sessions are reused across hours and files instead of logging in again for every hour
+ftp_pool = FTP_session_pool(connect_ftp, max_size=FTP_MAX_CONNECTIONS)
+_manifest = None
+_state = None
+_hour_executor = ThreadPoolExecutor(max_workers=HOUR_WORKERS, thread_name_prefix="himawari-hour")
+_file_executor = ThreadPoolExecutor(max_workers=FTP_MAX_CONNECTIONS, thread_name_prefix="himawari-file")
+# Processed GeoTIFFs in the shared file catalog, so local lookups do not list /home/slow_data
+CATALOG_SOURCE = "himawari"
+CATALOG_PRODUCT = "L2_ARP_031_AOD_vietnam"
+_catalog = None
 
 
 # --- Log Management ---
 def log_missing_data(timestamp, remote_path, reason="Directory not found"):
-    """Log missing data to file"""
+    """Record a missing hour in the state store and the human-readable log file, and queue it for re-checks"""
+    get_state().set_hour_status(timestamp, MISSING, reason)
+    schedule_retry(timestamp, reason)
     try:
         with open(MISSING_LOG_FILE, "a") as f:
             log_entry = f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} | {timestamp.strftime('%Y-%m-%d %H:%M')} | {remote_path} | {reason}\n"
@@ -48,196 +118,485 @@ def log_missing_data(timestamp, remote_path, reason="Directory not found"):
         print(f"⚠️ Could not write to missing data log: {e}")
 
 
-def get_local_files(local_path):
-    """Get set of all .nc files in local directory"""
-    if not os.path.exists(local_path):
-        return set()
+def himawari_obs_time(name):
+    """Observation time of a processed file, e.g. aod_vietnam_NC_H09_20231204_0000_....tif"""
+    parts = name.split("_")
     try:
-        return set([f.removeprefix("aod_vietnam_").removesuffix(".tif") for f in os.listdir(local_path)])
-    except Exception as e:
-        print(f"⚠️ Error reading local directory {local_path}: {e}")
-        return set()
+        return datetime.strptime(parts[4] + parts[5], "%Y%m%d%H%M")
+    except (IndexError, ValueError):
+        return None
+
+
+def get_local_files(timestamp):
+    """
+    Names (without aod_vietnam_ and .tif) of the processed files of one hour, looked up in the
+    file catalog (only used to bootstrap the state store)
+    """
+    rows = get_catalog().files_between(CATALOG_SOURCE, timestamp, timestamp + timedelta(hours=1))
+    return set(name.removeprefix("aod_vietnam_").removesuffix(".tif") for name, _, _, _ in rows)
+
+
+def record_processed_file(local_file, tif_path=None):
+    """Add the GeoTIFF produced from a .nc file to the file catalog"""
+    if tif_path is None:
+        stem = os.path.basename(local_file).removesuffix(".nc")
+        tif_path = os.path.join(os.path.dirname(local_file), f"aod_vietnam_{stem}.tif")
+    if os.path.exists(tif_path):
+        name = os.path.basename(tif_path)
+        get_catalog().record(CATALOG_SOURCE, name, tif_path, os.path.getsize(tif_path), himawari_obs_time(name),
+                             product=CATALOG_PRODUCT, checksum=file_md5(tif_path))
+
+
+# --- Worker Pool Management ---
+def _init_process_worker():
+    """Import the processing stack once when a worker process starts"""
+    import process_aod_data  # noqa: F401
+
+
+def _process_task(nc_path):
+    import process_aod_data
+    return process_aod_data.process_nc_file(nc_path)
+
+
+def get_process_pool():
+    """Return the shared processing pool, starting it on first use"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # spawn: the downloader is multi-threaded, forking it is not safe
+            ctx = multiprocessing.get_context("spawn")
+            _process_pool = ctx.Pool(
+                processes=PROCESS_WORKERS,
+                initializer=_init_process_worker,
+                maxtasksperchild=PROCESS_MAX_TASKS_PER_CHILD,
+            )
+            print(f"⚙️ Đã khởi động {PROCESS_WORKERS} worker xử lý AOD.")
+        return _process_pool
+
+
+def _retire_process_pool(pool):
+    """Terminate a pool holding a hung worker; the next task starts a fresh one"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.terminate()
+
+
+def process_downloaded_file(local_file):
+    """Run conversion, crop and station extraction for one downloaded .nc file"""
+    if PROCESS_WORKERS <= 0:
+        subprocess.run(["python", PROCESS_SCRIPT, local_file], check=True, timeout=PROCESS_TIMEOUT)
+        return
+
+    # Each task has its own deadline. Retiring a pool kills every task in it, so tasks that
+    # were only caught in another task's timeout are resubmitted to the fresh pool.
+    while True:
+        pool = get_process_pool()
+        result = pool.apply_async(_process_task, (local_file,))
+        deadline = time.monotonic() + PROCESS_TIMEOUT
+        while True:
+            try:
+                return result.get(timeout=max(0, min(PROCESS_POLL_INTERVAL, deadline - time.monotonic())))
+            except multiprocessing.TimeoutError:
+                if _process_pool is not pool and not result.ready():
+                    break  # Retired by another task: resubmit
+                if time.monotonic() >= deadline:
+                    _retire_process_pool(pool)
+                    raise
+
+
+# --- Processing Stage ---
+def _processor_loop():
+    """Consume downloaded .nc files from the queue and process them"""
+    while True:
+        timestamp, local_file = _process_queue.get()
+        file = os.path.basename(local_file)
+        try:
+            record_processed_file(local_file, process_downloaded_file(local_file))
+            get_state().set_file_status(timestamp, file, PROCESSED, local_file)
+            print(f"⚙️ Đã xử lý: {file} (hàng đợi: {queue_depth()})")
+        except (subprocess.TimeoutExpired, multiprocessing.TimeoutError):
+            get_state().set_file_status(timestamp, file, FAILED, local_file, "processing timeout")
+            schedule_retry(timestamp, f"processing timeout: {file}")
+            print(f"❌ Lỗi: Xử lý file {file} đã hết thời gian ({PROCESS_TIMEOUT} giây).")
+        except Exception as process_error:
+            get_state().set_file_status(timestamp, file, FAILED, local_file, str(process_error))
+            schedule_retry(timestamp, f"processing failed: {file}")
+            print(f"❌ Lỗi khi xử lý file {file}: {process_error}")
+            # Remove the .nc so the file is downloaded again on the next check
+            if os.path.exists(local_file):
+                os.remove(local_file)
+        finally:
+            _process_queue.task_done()
+
+
+def start_processing_stage():
+    """Start the processor threads once"""
+    with _processor_lock:
+        if _processor_threads:
+            return
+        for i in range(PROCESSOR_THREADS):
+            thread = threading.Thread(target=_processor_loop, name=f"himawari-process-{i}", daemon=True)
+            thread.start()
+            _processor_threads.append(thread)
+
+
+def queue_depth():
+    return f"{_process_queue.qsize()}/{PROCESS_QUEUE_SIZE}"
+
+
+def enqueue_for_processing(timestamp, local_file):
+    """Hand a downloaded file to the processing stage, blocking while the queue is full"""
+    start_processing_stage()
+    if _process_queue.full():
+        print(f"⏳ Hàng đợi xử lý đầy ({queue_depth()}), tạm dừng tải...")
+    _process_queue.put((timestamp, local_file))
+
+
+def resume_pending_processing():
+    """Re-queue files downloaded before a restart but never processed"""
+    state = get_state()
+    for timestamp, file, local_file in state.files_with_status(DOWNLOADED):
+        if local_file and os.path.exists(local_file):
+            print(f"🔁 Tiếp tục xử lý file đã tải: {file}")
+            enqueue_for_processing(timestamp, local_file)
+        else:
+            state.set_file_status(timestamp, file, FAILED, local_file, "downloaded file lost before processing")
 
 
-def fetch_file(file, local_path, ftp):
+def fetch_file(file, remote_path, local_path, timestamp):
     local_file = os.path.join(local_path, file)
+    # Size from the manifest (MLSD) saves a SIZE round trip; None -> asked from the server
+    expected_size = get_manifest().hour_files(timestamp).get(file)
     try:
-        with open(local_file, "wb") as f:
-            # Retrieve the file with retry logic
-            for attempt in range(3):
-                try:
-                    ftp.retrbinary(f"RETR {file}", f.write)
-                    break
-                except Exception as e:
-                    if attempt < 2:
-                        print(f"⚠️ Retry {attempt+1} for {file}")
-                        time.sleep(5)
-                    else:
-                        raise
+        # Retrieve the file with retry logic, on a pooled session; each retry resumes the .part file
+        for attempt in range(3):
+            try:
+                with ftp_pool.session() as ftp:
+                    ftp_pool.chdir(ftp, remote_path)
+                    # A stale manifest size must not fail every attempt: later attempts ask SIZE
+                    retr_resumable(ftp, file, local_file, expected_size if attempt == 0 else None)
+                break
+            except Exception as e:
+                if attempt < 2:
+                    print(f"⚠️ Retry {attempt+1} for {file}")
+                    time.sleep(5)
+                else:
+                    raise
         print(f"✅ Downloaded: {file}")
         
-        # Process the .nc file
-        subprocess.run(["python", PROCESS_SCRIPT, local_file], check=True, timeout=300)
-        
-    except subprocess.TimeoutExpired:
-        print(f"❌ Lỗi: Xử lý file {file} đã hết thời gian (5 phút).")
     except Exception as file_error:
-        print(f"❌ Lỗi khi tải hoặc xử lý file {file}: {file_error}")
-        # Clean up partially downloaded file
-        if os.path.exists(local_file):
-            os.remove(local_file)
+        print(f"❌ Lỗi khi tải file {file}: {file_error}")
+        get_state().set_file_status(timestamp, file, FAILED, local_file, str(file_error))
+        schedule_retry(timestamp, f"download failed: {file}")
+        # The partial .part file is kept so the re-check only downloads the missing bytes
+        return
+
+    get_state().set_file_status(timestamp, file, DOWNLOADED, local_file)
+    # Process the .nc file in the processing stage
+    enqueue_for_processing(timestamp, local_file)
+
+
+def hour_paths(timestamp):
+    """Remote and local directory of one Himawari hour"""
+    ymd = timestamp.strftime("%Y%m")
+    dd = timestamp.strftime("%d")
+    hh = timestamp.strftime("%H")
+    return f"{BASE_DIR}/{ymd}/{dd}/{hh}/", os.path.join(LOCAL_BASE, ymd, dd, hh)
+
+
+# --- Remote Manifest and State Store ---
+def get_state():
+    """Return the downloader state store, opening its database on first use"""
+    global _state
+    if _state is None:
+        _state = Himawari_state_store()
+    return _state
+
+
+def get_catalog():
+    """Return the shared file catalog, opening its database on first use"""
+    global _catalog
+    if _catalog is None:
+        _catalog = File_catalog()
+    return _catalog
+
+
+def get_manifest():
+    """Return the remote listing manifest, opening its database on first use"""
+    global _manifest
+    if _manifest is None:
+        _manifest = Himawari_manifest(BASE_DIR)
+    return _manifest
+
+
+def refresh_manifest(start, end):
+    """List the remote hours in [start, end] not yet settled in the manifest"""
+    with ftp_pool.session() as ftp:
+        requests = get_manifest().refresh(ftp, start, end)
+    if requests:
+        print(f"🗂️ Đã cập nhật manifest {start.strftime('%Y-%m-%d %H:%M')} → {end.strftime('%Y-%m-%d %H:%M')} ({requests} lệnh liệt kê)")
+
+
+def find_latest_available_hour(not_before=None):
+    """Newest Himawari hour published on the server, from a handful of directory listings"""
+    with ftp_pool.session() as ftp:
+        latest = get_manifest().find_latest_hour(ftp, not_before)
+    if latest is not None:
+        print(f"🛰️ Dữ liệu mới nhất trên server: {latest.strftime('%Y-%m-%d %H:%M')}")
+    return latest
 
 
 # --- Core FTP and Processing Logic ---
-def download_and_process(ftp, remote_path, local_path, timestamp):
+def download_and_process(remote_path, local_path, timestamp, published=True):
     """
-    Attempts to connect to a remote directory, downloads new files, and processes them.
+    Downloads the files of one hour that are in the remote manifest but not on disk, and processes them.
+    The manifest must have been refreshed for this hour (see refresh_manifest).
+    Files of the hour are fetched in parallel, each on its own pooled FTP session.
+    
+    `published` tells whether the hour is at or before the newest hour on the server:
+    only then is a missing directory a real gap, otherwise it is simply not published yet.
     
     Returns:
-        bool: True if the remote directory was successfully accessed (even if empty/no new files).
-              False if accessing the remote path failed (e.g., directory does not exist).
+        bool: True if the remote directory exists (even if empty/no new files).
+              False if the directory does not exist in the remote listing.
     """
-    os.makedirs(local_path, exist_ok=True)
-    
-    try:
-        # Change to the remote directory
-        ftp.cwd(remote_path)
+    manifest = get_manifest()
+    if not manifest.hour_exists(timestamp):
+        if not published:
+            print(f"⌛ {remote_path} chưa được công bố.")
+            # Re-checked later by the retry scheduler in case it is published late
+            schedule_retry(timestamp, "not published yet")
+            return False
+        print(f"⛔ Không có thư mục {remote_path} trên server")
         
-        # Get list of files in the current remote directory
-        remote_files = ftp.nlst()
-        remote_nc_files = [f for f in remote_files if f.endswith('.nc')]
-        
-        # Get list of files already downloaded locally
-        local_files = get_local_files(local_path)
-        # print(local_files)
+        # Log the missing data
+        log_missing_data(timestamp, remote_path, "Directory not found in remote listing")
         
-        # Filter files that need to be downloaded
-        files_to_download = [f for f in remote_nc_files if f.removesuffix(".nc") not in local_files]
-        # print(files_to_download)
+        return False
 
-        
-        if not files_to_download:
-            if remote_nc_files:
-                print(f"✔️ Đã kiểm tra {remote_path}. Tất cả {len(remote_nc_files)} file .nc đã tồn tại.")
-            else:
-                print(f"✔️ Đã kiểm tra {remote_path}. Không có file .nc.")
-            return True
-
-        print(f"📥 Bắt đầu tải {len(files_to_download)} file mới từ {remote_path}...")
-        
-        for file in files_to_download:
-            fetch_file(file, local_path, ftp)
+    state = get_state()
+    hour_status = state.hour_status(timestamp)
+    remote_nc_files = manifest.hour_files(timestamp)
+    state.mark_listed(timestamp, remote_nc_files)
+
+    if hour_status is None:
+        # Giờ chưa có trong state store: nhập các file đã xử lý từ đĩa (chỉ một lần)
+        local_files = get_local_files(timestamp)
+        for file in remote_nc_files:
+            if file.removesuffix(".nc") in local_files:
+                state.set_file_status(timestamp, file, PROCESSED, os.path.join(local_path, file))
+    
+    # Filter files that need to be downloaded (indexed lookup, no disk or network access)
+    done_files = state.done_files(timestamp)
+    files_to_download = [f for f in remote_nc_files if f not in done_files]
+    # print(files_to_download)
 
-        return True  # Successfully accessed the directory
+    
+    if not files_to_download:
+        if remote_nc_files:
+            print(f"✔️ Đã kiểm tra {remote_path}. Tất cả {len(remote_nc_files)} file .nc đã tồn tại.")
+        else:
+            print(f"✔️ Đã kiểm tra {remote_path}. Không có file .nc.")
+        statuses = state.file_statuses(timestamp)
+        all_processed = all(statuses.get(f) == PROCESSED for f in remote_nc_files)
+        state.set_hour_status(timestamp, COMPLETE if all_processed else LISTED)
+        state.clear_retry(timestamp)  # e.g. queued by a real-time poll before it was published
+        return True
+
+    state.set_hour_status(timestamp, LISTED)
+    os.makedirs(local_path, exist_ok=True)
+    print(f"📥 Bắt đầu tải {len(files_to_download)} file mới từ {remote_path}...")
+    
+    futures = [_file_executor.submit(fetch_file, file, remote_path, local_path, timestamp) for file in files_to_download]
+    for future in futures:
+        future.result()
+    clear_retry_if_done(timestamp)
+
+    return True  # Successfully accessed the directory
+
+
+# --- Missing-Hour Retry Scheduler ---
+def schedule_retry(timestamp, reason):
+    get_state().schedule_retry(timestamp, reason, RETRY_BASE_DELAY)
+
+
+def clear_retry_if_done(timestamp):
+    """Drop an hour from the retry queue once it is downloaded without failed files"""
+    state = get_state()
+    if FAILED not in state.file_statuses(timestamp).values():
+        state.clear_retry(timestamp)
+
+
+def retry_delay(attempts):
+    return min(RETRY_BASE_DELAY * 2 ** attempts, RETRY_MAX_DELAY)
+
+
+def retry_missing_hours():
+    """Re-check the hours in the retry queue that are due, in one batch over a shared FTP session"""
+    state = get_state()
+    due = state.due_retries(RETRY_BATCH_SIZE)
+    if not due:
+        return
+
+    print(f"🔁 Kiểm tra lại {len(due)} giờ thiếu/lỗi (hàng đợi thử lại: {state.retry_queue_size()})")
+    manifest = get_manifest()
+    with ftp_pool.session() as ftp:
+        manifest.recheck_hours(ftp, [t for t, _, _ in due])
+
+    found = []
+    for timestamp, attempts, queued_seconds in due:
+        expired = queued_seconds >= RETRY_HORIZON.total_seconds()
+        if manifest.hour_exists(timestamp):
+            failed = [name for name, status in state.file_statuses(timestamp).items() if status == FAILED]
+            if failed and expired:
+                # Give up on files that kept failing; a newly published hour is still downloaded below
+                state.clear_retry(timestamp)
+                state.set_hour_status(timestamp, FAILED, f"{len(failed)} file(s) still failing after {attempts + 1} re-checks")
+                print(f"🚫 {timestamp.strftime('%Y-%m-%d %H:%M')}: {len(failed)} file vẫn lỗi sau {RETRY_HORIZON.days} ngày, ngừng thử lại.")
+                continue
+            # Published, or failed files to fetch/process again: stays queued (backing off) until no file failed
+            state.reschedule_retry(timestamp, retry_delay(attempts + 1))
+            found.append(timestamp)
+        elif expired:
+            # Give up on a directory that never appeared
+            state.clear_retry(timestamp)
+            state.set_hour_status(timestamp, ABSENT, f"still missing after {attempts + 1} re-checks")
+            print(f"🚫 {timestamp.strftime('%Y-%m-%d %H:%M')}: không có dữ liệu sau {RETRY_HORIZON.days} ngày, ngừng kiểm tra.")
+        else:
+            state.reschedule_retry(timestamp, retry_delay(attempts + 1))
 
-    except Exception as e:
-        # This catches errors like 550 (directory not found) or connection issues
-        error_msg = str(e)
-        print(f"⛔ Không truy cập được thư mục {remote_path}: {error_msg}")
-        
-        # Log the missing data
-        log_missing_data(timestamp, remote_path, error_msg)
-        
-        return False
+    if found:
+        print(f"📬 {len(found)} giờ đã có dữ liệu, bắt đầu tải.")
+        list(_hour_executor.map(check_hour, found))
+
+
+def check_hour(timestamp, published=True):
+    """Download and process one hour; returns whether its remote directory exists"""
+    remote_path, local_path = hour_paths(timestamp)
+    return download_and_process(remote_path, local_path, timestamp, published)
 
 
 def historical_mode():
-    """Download historical data with gap tracking"""
+    """
+    Download historical data up to the newest hour published on the server, checking
+    HOUR_WORKERS hours in parallel. Missing hours before that point are real gaps and
+    are logged; hours after it are left to real-time mode.
+    """
     global start_time_holder
-    
-    consecutive_missing_count = 0
-    first_missing_time = None  # Track where the gap started
+
+    latest_hour = None
     
     while True:
-        current_time = start_time_holder
-        
-        # Check if we've caught up to present (leaving 2 hours buffer for data availability)
-        if current_time >= datetime.now() - timedelta(hours=2):
-            print("🏁 Đã hoàn thành tải lịch sử.")
-            print("🔄 Chuyển sang chế độ theo dõi thời gian thực.")
-            return  # Exit to switch to real-time mode
-        
         try:
-            print(f"\n🚀 [HISTORICAL] Đang kiểm tra: {current_time.strftime('%Y-%m-%d %H:%M:%S')}")
-            
-            with FTP(FTP_HOST, timeout=30) as ftp:
-                ftp.login(FTP_USER, FTP_PASS)
-                
-                # Build paths
-                ymd = current_time.strftime("%Y%m")
-                dd = current_time.strftime("%d")
-                hh = current_time.strftime("%H")
-                remote_path = f"{BASE_DIR}/{ymd}/{dd}/{hh}/"
-                local_path = os.path.join(LOCAL_BASE, ymd, dd, hh)
-
-                # Download and process
-                directory_found = download_and_process(ftp, remote_path, local_path, current_time)
-
-            if directory_found:
-                # Reset missing counter when data is found
-                consecutive_missing_count = 0
-                first_missing_time = None
-                
-                # Move to next hour
-                start_time_holder += timedelta(hours=1)
-                time.sleep(1)
-                
-            else:
-                # Data not found
-                if first_missing_time is None:
-                    first_missing_time = current_time
-                
-                consecutive_missing_count += 1
-                
-                # Check if we've exceeded the threshold
-                if consecutive_missing_count >= MAX_CONSECUTIVE_MISSING:
-                    print(f"⚠️ {MAX_CONSECUTIVE_MISSING} giờ liên tiếp không có dữ liệu từ {first_missing_time.strftime('%Y-%m-%d %H:%M')}.")
-                    print("🔄 Giả định đã đuổi kịp dữ liệu mới nhất. Chuyển sang chế độ real-time.")
-                    
-                    start_time_holder = first_missing_time
+            if latest_hour is None or start_time_holder > latest_hour:
+                # Find (or re-check) the newest published hour before deciding we have caught up
+                latest_hour = find_latest_available_hour(not_before=start_time_holder)
+                if latest_hour is None or start_time_holder > latest_hour:
+                    print("🏁 Đã hoàn thành tải lịch sử.")
+                    print("🔄 Chuyển sang chế độ theo dõi thời gian thực.")
                     return  # Exit to switch to real-time mode
-                else:
-                    # Continue to next hour to find where data resumes
-                    print(f"⏩ Bỏ qua giờ này ({consecutive_missing_count}/{MAX_CONSECUTIVE_MISSING} missing). Tiếp tục...")
-                    start_time_holder += timedelta(hours=1)
-                    time.sleep(1)
+
+            batch = [start_time_holder + timedelta(hours=i) for i in range(HOUR_WORKERS)]
+            batch = [t for t in batch if t <= latest_hour]
+            print(f"\n🚀 [HISTORICAL] Đang kiểm tra: {batch[0].strftime('%Y-%m-%d %H:%M:%S')} → {batch[-1].strftime('%Y-%m-%d %H:%M:%S')} (hàng đợi xử lý: {queue_depth()})")
+
+            refresh_manifest(batch[0], batch[-1])
+            futures = [_hour_executor.submit(check_hour, t) for t in batch]
+
+            # Results are consumed in time order so start_time_holder only moves past finished hours
+            for current_time, future in zip(batch, futures):
+                if not future.result():
+                    # Gap before the newest published hour (already logged as missing)
+                    print(f"⏩ Bỏ qua giờ {current_time.strftime('%Y-%m-%d %H:%M')} (không có dữ liệu). Tiếp tục...")
+                start_time_holder = current_time + timedelta(hours=1)
+
+            retry_missing_hours()
 
         except Exception as e:
+            # Hours after the failed one are retried from start_time_holder
             print(f"⚠️ Lỗi khi kết nối FTP: {e}")
             time.sleep(30)
 
+        finally:
+            # Persist progress so a restart resumes here instead of from the initial date
+            get_state().set_checkpoint(start_time_holder)
+
+
+def next_poll_delay(target_hour, overdue_polls):
+    """
+    Seconds to wait before looking for `target_hour` again, based on observed publication delay.
+
+    Returns:
+        tuple: (delay, overdue) where overdue is True once the expected arrival window has passed.
+    """
+    quantiles = get_manifest().latency_quantiles()
+    if quantiles is None:
+        return REALTIME_DEFAULT_POLL, False
+
+    p10, _, p90 = quantiles
+    now = utc_now()  # Observation hours are UTC
+    window_start = target_hour + timedelta(seconds=p10) - REALTIME_WINDOW_MARGIN
+    window_end = target_hour + timedelta(seconds=p90) + REALTIME_WINDOW_MARGIN
+    if now < window_start:
+        # Too early: sleep until the arrival window opens
+        return min(max((window_start - now).total_seconds(), REALTIME_FAST_POLL), REALTIME_MAX_POLL), False
+    if now <= window_end:
+        return REALTIME_FAST_POLL, False
+    # Later than usual: back off exponentially
+    return min(REALTIME_FAST_POLL * 2 ** overdue_polls, REALTIME_MAX_POLL), True
+
 
 def realtime_mode():
-    """Monitor and download real-time data"""
+    """
+    Monitor and download real-time data. The next expected hour is polled aggressively around
+    its expected publication time (learned from past arrivals) and rarely otherwise.
+    Every poll also lists the hours up to the current one, so an hour that is never
+    published does not hold back newer hours: the target moves past it as soon as a
+    newer hour is present.
+    """
     global start_time_holder
+
+    target_hour = None
+    overdue_polls = 0
     
     while True:
-        # Always check the last 2 hours to ensure we don't miss any data
-        current_hour = datetime.now().replace(minute=0, second=0, microsecond=0)
-        check_times = [current_hour - timedelta(hours=2), current_hour - timedelta(hours=1)]
+        current_hour = utc_now().replace(minute=0, second=0, microsecond=0)
+        latest_hour = get_manifest().latest_present_hour()
+        next_hour = latest_hour + timedelta(hours=1) if latest_hour is not None else current_hour - REALTIME_LOOKBACK
+        next_hour = max(next_hour, current_hour - REALTIME_LOOKBACK)
+        if next_hour != target_hour:
+            target_hour = next_hour
+            overdue_polls = 0
+
+        # The previous hour is checked again for files published late, and the newest hours
+        # are always probed in case the target hour is skipped on the server
+        check_times = [target_hour - timedelta(hours=1)]
+        while check_times[-1] < max(target_hour, current_hour):
+            check_times.append(check_times[-1] + timedelta(hours=1))
         
         try:
             for check_time in check_times:
                 print(f"\n🚀 [REAL-TIME] Đang kiểm tra: {check_time.strftime('%Y-%m-%d %H:%M:%S')}")
-                
-                with FTP(FTP_HOST, timeout=30) as ftp:
-                    ftp.login(FTP_USER, FTP_PASS)
-                    
-                    # Build paths
-                    ymd = check_time.strftime("%Y%m")
-                    dd = check_time.strftime("%d")
-                    hh = check_time.strftime("%H")
-                    remote_path = f"{BASE_DIR}/{ymd}/{dd}/{hh}/"
-                    local_path = os.path.join(LOCAL_BASE, ymd, dd, hh)
-
-                    # Download and process (missing data is already logged inside)
-                    download_and_process(ftp, remote_path, local_path, check_time)
-                    
-                    time.sleep(1)
-            
-            # Wait 10 minutes before next check
-            print(f"\n⏳ [REAL-TIME] Chờ 10 phút trước khi kiểm tra lại...")
-            time.sleep(600)
+
+            # Download and process (missing data is already logged inside)
+            refresh_manifest(check_times[0], check_times[-1])
+            latest_hour = get_manifest().latest_present_hour()
+            published = [latest_hour is not None and t <= latest_hour for t in check_times]
+            list(_hour_executor.map(check_hour, check_times, published))
+            retry_missing_hours()
+
+            if latest_hour is not None and latest_hour >= target_hour and target_hour < current_hour:
+                # The target (or a newer hour, skipping a missing one) is out: catching up after
+                # downtime or a gap, look for the following hour straight away
+                continue
+
+            delay, overdue = next_poll_delay(target_hour, overdue_polls)
+            if overdue:
+                overdue_polls += 1
+            print(f"\n⏳ [REAL-TIME] Chờ {delay / 60:.1f} phút trước khi tìm {target_hour.strftime('%Y-%m-%d %H:%M')}... (hàng đợi xử lý: {queue_depth()})")
+            time.sleep(delay)
 
         except Exception as e:
             print(f"⚠️ Lỗi khi kết nối FTP: {e}")
@@ -247,10 +606,21 @@ def realtime_mode():
 def main():
     """Main loop for managing historical and real-time modes"""
     global start_time_holder
+
+    # Resume from the last checkpoint, and finish processing files downloaded before the restart
+    checkpoint = get_state().get_checkpoint()
+    if checkpoint is not None:
+        start_time_holder = checkpoint
+        print(f"📌 Tiếp tục từ checkpoint: {start_time_holder.strftime('%Y-%m-%d %H:%M')}")
+    # Catalog the GeoTIFFs processed before the catalog existed (first run only)
+    if get_catalog().count(CATALOG_SOURCE) == 0:
+        get_catalog().bootstrap(CATALOG_SOURCE, LOCAL_BASE, himawari_obs_time, product=CATALOG_PRODUCT,
+                          pattern="aod_vietnam_*.tif")
+    resume_pending_processing()
     
     while True:
         # Check if we should start in real-time mode
-        if start_time_holder >= datetime.now() - timedelta(hours=2):
+        if start_time_holder >= utc_now() - timedelta(hours=2):
             print("🔄 Bắt đầu ở chế độ real-time.")
             realtime_mode()
         else:
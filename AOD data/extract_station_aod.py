@@ -1,73 +1,49 @@
 import sys
 import os
-import pandas as pd
+# Get the absolute path of the current script's directory
+current_script_dir = os.path.dirname(os.path.abspath(__file__))
+# Add the parent directory to sys.path (for util)
+sys.path.append(os.path.join(current_script_dir, os.pardir))
 import rasterio
 import numpy as np
 
-if len(sys.argv) < 2:
-    print("⚠️ Thiếu đường dẫn file GeoTIFF")
-    sys.exit(1)
+from station_aod_store import append_station_aod
+from util.stations import get_stations, station_pixel_indices
 
-aod_file = sys.argv[1]
-stations_file = "/home/work1/projects/Air_Quality/AOD data/vietnam_meteostat_stations.csv"
-OUTPUT_DIR = "/home/slow_data/Air_Quality/AOD/station_aod"
 
-# Các ngưỡng uncertainty và tên file tương ứng
-uncertainty_thresholds = [0.5, 0.7, 0.8, 1, 1.2, 1.5]
-output_files = [OUTPUT_DIR + f"/all_station{str(threshold).replace('.', '')}.csv" for threshold in uncertainty_thresholds]
+def sample_station_values(aod_file, stations):
+    """Read AOT and AOT_uncertainty at every station with a single gather from both bands"""
+    with rasterio.open(aod_file) as src:
+        rows, cols, inside = station_pixel_indices(src.transform, src.shape,
+                                                   stations["longitude"].values, stations["latitude"].values)
+        bands = src.read([1, 2])
 
-# Lấy timestamp từ tên file
-filename = os.path.basename(aod_file)
-parts = filename.split("_")
-timestamp = parts[4] + "_" + parts[5]
-aot_col_name = f"AOT_{timestamp}"
+    values = np.full((2, len(stations)), np.nan, dtype="float32")
+    values[:, inside] = bands[:, rows[inside], cols[inside]]
+    return values[0], values[1]
 
-# Đọc danh sách trạm
-stations = pd.read_csv(stations_file)
-stations = stations.rename(columns={"name": "station_name"})
 
-if "station_id" not in stations.columns:
-    stations["station_id"] = range(len(stations))
+def extract_station_aod(aod_file, stations=None):
+    """Extract station AOT and uncertainty from a cropped Vietnam GeoTIFF and append them to the station AOD store."""
+    if stations is None:
+        stations = get_stations()
 
-# Đọc ảnh AOT và uncertainty
-with rasterio.open(aod_file) as src:
-    # Đọc toàn bộ band 1 và band 2 trước để tăng tốc
-    aot_band = src.read(1)
-    uncertainty_band = src.read(2)
-    
-    # Tạo dict để lưu giá trị cho từng ngưỡng
-    aot_values_dict = {threshold: [] for threshold in uncertainty_thresholds}
-    
-    for _, row in stations.iterrows():
-        lon, lat = row["longitude"], row["latitude"]
-        try:
-            rowcol = src.index(lon, lat)
-            aot_value = aot_band[rowcol[0], rowcol[1]]
-            uncertainty_value = uncertainty_band[rowcol[0], rowcol[1]]
-            
-            for threshold in uncertainty_thresholds:
-                if np.isnan(aot_value) or np.isnan(uncertainty_value) or uncertainty_value >= threshold:
-                    aot_values_dict[threshold].append(None)
-                else:
-                    aot_values_dict[threshold].append(aot_value)
-        except Exception as e:
-            for threshold in uncertainty_thresholds:
-                aot_values_dict[threshold].append(None)
+    # Lấy timestamp từ tên file
+    filename = os.path.basename(aod_file)
+    parts = filename.split("_")
+    timestamp = parts[4] + "_" + parts[5]
 
-# Lưu ra các file CSV tương ứng với từng ngưỡng uncertainty
-for threshold, output_csv in zip(uncertainty_thresholds, output_files):
-    stations_copy = stations.copy()
-    stations_copy[aot_col_name] = aot_values_dict[threshold]
-    
-    # Ghi hoặc cập nhật file tổng
-    if os.path.exists(output_csv):
-        df_old = pd.read_csv(output_csv)
-        df_merged = pd.merge(df_old, 
-                            stations_copy[["station_id", aot_col_name]], 
-                            on="station_id", 
-                            how="left")
-    else:
-        df_merged = stations_copy[["station_id", "station_name", "latitude", "longitude", 
-                                 aot_col_name]]
-    df_merged.to_csv(output_csv, index=False)
-print(f"✅ Hoàn tất xử lý ")
\ No newline at end of file
+    # Đọc AOT và uncertainty tại vị trí các trạm (một lần gather cho cả hai band)
+    aot_values, uncertainty_values = sample_station_values(aod_file, stations)
+
+    # Ghi thêm vào kho dữ liệu dạng dài; các ngưỡng uncertainty được áp dụng khi đọc/xuất
+    append_station_aod(timestamp, stations["station_id"].values, aot_values, uncertainty_values)
+    print(f"✅ Hoàn tất xử lý ")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("⚠️ Thiếu đường dẫn file GeoTIFF")
+        sys.exit(1)
+
+    extract_station_aod(sys.argv[1])
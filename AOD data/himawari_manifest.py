@@ -0,0 +1,267 @@
+import os
+import time
+import sqlite3
+import threading
+import statistics
+from datetime import datetime, timedelta, timezone
+from ftplib import error_perm
+
+# Manifest cục bộ của cây thư mục BASE_DIR/{yyyymm}/{dd}/{hh} trên server JAXA.
+# Mỗi ngày được liệt kê bằng một lệnh (MLSD nếu server hỗ trợ, kèm size và modify),
+# mỗi giờ có dữ liệu thêm một lệnh. Giờ/ngày đã quá SETTLE_HOURS được coi là cố định
+# và không bao giờ liệt kê lại.
+MANIFEST_DB = "/home/work1/projects/Air_Quality/AOD data/himawari_manifest.sqlite"
+SETTLE_HOURS = 48  # JAXA có thể upload muộn; sau khoảng này danh sách không còn thay đổi
+# Không có thời gian modify (NLST): chỉ dùng lần thấy đầu tiên làm mẫu độ trễ nếu giờ còn mới
+ARRIVAL_SAMPLE_MAX_AGE_HOURS = 6
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS remote_days (
+    day TEXT PRIMARY KEY,          -- yyyymm/dd
+    present INTEGER NOT NULL,
+    hours TEXT NOT NULL,           -- hour directories, e.g. "00,01,...,23"
+    listed_at REAL NOT NULL,
+    final INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS remote_hours (
+    hour TEXT PRIMARY KEY,         -- yyyymm/dd/hh
+    present INTEGER NOT NULL,
+    listed_at REAL NOT NULL,
+    final INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS hour_arrivals (
+    hour TEXT PRIMARY KEY,
+    latency REAL NOT NULL          -- seconds from observation time to publication
+);
+CREATE TABLE IF NOT EXISTS remote_files (
+    hour TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER,
+    modify TEXT,
+    PRIMARY KEY (hour, name)
+);
+"""
+
+
+def utc_now():
+    """Current time as a naive UTC datetime, the clock of the remote tree and of MLSD `modify` facts"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def day_key(timestamp):
+    return timestamp.strftime("%Y%m/%d")
+
+
+def hour_key(timestamp):
+    return timestamp.strftime("%Y%m/%d/%H")
+
+
+class Himawari_manifest:
+    """Persistent listing of the remote Himawari archive, refreshed incrementally"""
+
+    def __init__(self, base_dir, db_path=MANIFEST_DB, settle_hours=SETTLE_HOURS):
+        self.base_dir = base_dir.rstrip("/")
+        self.settle = timedelta(hours=settle_hours)
+        self._mlsd_supported = None  # Unknown until the first listing
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    # --- Remote listing ---
+    def _list_dir(self, ftp, path):
+        """
+        Entries of a remote directory as {name: facts}, using MLSD when supported.
+        Raises error_perm (550) if the directory does not exist.
+        """
+        if self._mlsd_supported is not False:
+            try:
+                entries = {name: facts for name, facts in ftp.mlsd(path, facts=["type", "size", "modify"])
+                           if name not in (".", "..")}
+                self._mlsd_supported = True
+                return entries
+            except error_perm as e:
+                # 500/502/504: MLSD không được hỗ trợ -> dùng NLST
+                if str(e)[:3] not in ("500", "502", "504"):
+                    raise
+                print("ℹ️ Server không hỗ trợ MLSD, dùng NLST.")
+                self._mlsd_supported = False
+
+        names = ftp.nlst(path)
+        return {os.path.basename(name.rstrip("/")): {} for name in names}
+
+    def refresh(self, ftp, start, end):
+        """
+        Update the manifest for every hour in [start, end]. Settled days and hours already
+        in the manifest are skipped, so repeated refreshes only touch recent data.
+
+        Returns:
+            int: number of listing requests sent to the server.
+        """
+        requests = 0
+        day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+
+        while day <= end:
+            hours = [day + timedelta(hours=h) for h in range(24) if start <= day + timedelta(hours=h) <= end]
+            with self._lock:
+                pending = [t for t in hours if not self._hour_is_final(t)]
+            if pending:
+                requests += self._refresh_day(ftp, day, pending, force=False)
+            day += timedelta(days=1)
+
+        return requests
+
+    def recheck_hours(self, ftp, hours):
+        """
+        List the given hours again even if they are settled (for late uploads), sending one
+        day listing per distinct day plus one listing per hour directory found.
+
+        Returns:
+            int: number of listing requests sent to the server.
+        """
+        by_day = {}
+        for t in sorted(hours):
+            by_day.setdefault(t.replace(hour=0, minute=0, second=0, microsecond=0), []).append(t)
+        return sum(self._refresh_day(ftp, day, day_hours, force=True) for day, day_hours in by_day.items())
+
+    def _refresh_day(self, ftp, day, hours, force):
+        """List one day directory (unless settled and not forced) and the given hours in it"""
+        requests = 0
+        now = utc_now()
+        day_end = day + timedelta(days=1)
+        remote_day = f"{self.base_dir}/{day_key(day)}"
+
+        with self._lock:
+            row = self._db.execute("SELECT hours, final FROM remote_days WHERE day = ?",
+                                   (day_key(day),)).fetchone()
+        if row is not None and row[1] and not force:
+            # Danh sách giờ của ngày đã cố định, không cần hỏi lại server
+            hour_names = set(row[0].split(",")) if row[0] else set()
+        else:
+            try:
+                hour_names = set(self._list_dir(ftp, remote_day))
+                day_present = True
+            except error_perm as e:
+                if not str(e).startswith("550"):
+                    raise
+                hour_names = set()
+                day_present = False
+            requests += 1
+            self._save_day(day, day_present, hour_names, final=now - day_end >= self.settle)
+
+        for t in hours:
+            if t.strftime("%H") not in hour_names:
+                # Thư mục giờ không tồn tại (chưa có hoặc thiếu dữ liệu)
+                self._save_hour(t, False, {}, final=now - t >= self.settle)
+                continue
+            try:
+                entries = self._list_dir(ftp, f"{remote_day}/{t.strftime('%H')}")
+            except error_perm as e:
+                if not str(e).startswith("550"):
+                    raise
+                entries = None
+            requests += 1
+            if entries is None:
+                self._save_hour(t, False, {}, final=now - t >= self.settle)
+            else:
+                files = {name: facts for name, facts in entries.items()
+                         if name.endswith(".nc") and facts.get("type", "file") == "file"}
+                self._save_hour(t, True, files, final=now - t >= self.settle)
+
+        return requests
+
+    def find_latest_hour(self, ftp, not_before=None):
+        """
+        Newest hour directory published on the server, found by walking the month, day and
+        hour listings from the newest end (normally three requests). Empty day or month
+        directories are skipped. Returns None if nothing is found at or after `not_before`.
+        """
+        def digit_names(path, width):
+            return sorted((n for n in self._list_dir(ftp, path) if n.isdigit() and len(n) == width), reverse=True)
+
+        for month in digit_names(self.base_dir, 6):
+            if not_before is not None and month < not_before.strftime("%Y%m"):
+                return None
+            for day in digit_names(f"{self.base_dir}/{month}", 2):
+                if not_before is not None and f"{month}{day}" < not_before.strftime("%Y%m%d"):
+                    return None
+                hours = digit_names(f"{self.base_dir}/{month}/{day}", 2)
+                if hours:
+                    return datetime.strptime(f"{month}{day}{hours[0]}", "%Y%m%d%H")
+        return None
+
+    # --- Persistence ---
+    def _hour_is_final(self, timestamp):
+        row = self._db.execute("SELECT final FROM remote_hours WHERE hour = ?", (hour_key(timestamp),)).fetchone()
+        return row is not None and bool(row[0])
+
+    def _save_day(self, day, present, hour_names, final):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO remote_days VALUES (?, ?, ?, ?, ?)",
+                             (day_key(day), int(present), ",".join(sorted(hour_names)), time.time(), int(final)))
+            self._db.commit()
+
+    def _arrival_latency(self, timestamp, files):
+        """Seconds between observation time and publication of an hour, or None if unknown"""
+        # Observation hours and MLSD modify facts (RFC 3659) are both UTC
+        modify_times = [facts["modify"][:14] for facts in files.values() if facts.get("modify")]
+        if modify_times:
+            published = datetime.strptime(min(modify_times), "%Y%m%d%H%M%S")
+        elif utc_now() - timestamp <= timedelta(hours=ARRIVAL_SAMPLE_MAX_AGE_HOURS):
+            published = utc_now()
+        else:
+            return None
+        return (published - timestamp).total_seconds()
+
+    def _save_hour(self, timestamp, present, files, final):
+        key = hour_key(timestamp)
+        latency = self._arrival_latency(timestamp, files) if files else None
+        with self._lock:
+            if latency is not None:
+                # Chỉ lần xuất hiện đầu tiên của giờ là thời điểm công bố
+                self._db.execute("INSERT OR IGNORE INTO hour_arrivals VALUES (?, ?)", (key, latency))
+            self._db.execute("INSERT OR REPLACE INTO remote_hours VALUES (?, ?, ?, ?)",
+                             (key, int(present), time.time(), int(final)))
+            self._db.execute("DELETE FROM remote_files WHERE hour = ?", (key,))
+            self._db.executemany(
+                "INSERT INTO remote_files VALUES (?, ?, ?, ?)",
+                [(key, name, int(facts["size"]) if "size" in facts else None, facts.get("modify"))
+                 for name, facts in files.items()])
+            self._db.commit()
+
+    # --- Queries ---
+    def hour_exists(self, timestamp):
+        """True/False if the hour directory is known to exist or not, None if never listed"""
+        with self._lock:
+            row = self._db.execute("SELECT present FROM remote_hours WHERE hour = ?",
+                                   (hour_key(timestamp),)).fetchone()
+        return None if row is None else bool(row[0])
+
+    def latest_present_hour(self):
+        """Newest hour whose directory exists according to the manifest"""
+        with self._lock:
+            row = self._db.execute("SELECT MAX(hour) FROM remote_hours WHERE present = 1").fetchone()
+        return None if row[0] is None else datetime.strptime(row[0], "%Y%m/%d/%H")
+
+    def latency_quantiles(self, limit=200, min_samples=5):
+        """
+        (p10, p50, p90) in seconds of the publication delay of the `limit` newest hours,
+        or None with fewer than `min_samples` observations.
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT latency FROM hour_arrivals ORDER BY hour DESC LIMIT ?",
+                                    (limit,)).fetchall()
+        latencies = [row[0] for row in rows if row[0] >= 0]
+        if len(latencies) < min_samples:
+            return None
+        deciles = statistics.quantiles(latencies, n=10)
+        return deciles[0], statistics.median(latencies), deciles[-1]
+
+    def hour_files(self, timestamp):
+        """{file name: size or None} of the .nc files listed for an hour"""
+        with self._lock:
+            rows = self._db.execute("SELECT name, size FROM remote_files WHERE hour = ?",
+                                    (hour_key(timestamp),)).fetchall()
+        return dict(rows)
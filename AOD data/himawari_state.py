@@ -0,0 +1,163 @@
+import os
+import time
+import sqlite3
+import threading
+from datetime import datetime
+
+from himawari_manifest import hour_key
+
+# Trạng thái tải/xử lý của downloader Himawari, lưu trong SQLite để khởi động lại ngay lập tức
+# mà không phải quét lại thư mục trên /home/slow_data.
+#
+#   file: listed -> downloaded -> processed   (hoặc failed)
+#   hour: listed | missing | complete | absent | failed (hai trạng thái cuối: đã thử lại quá RETRY horizon)
+STATE_DB = "/home/work1/projects/Air_Quality/AOD data/himawari_state.sqlite"
+
+LISTED = "listed"
+DOWNLOADED = "downloaded"
+PROCESSED = "processed"
+FAILED = "failed"
+MISSING = "missing"
+COMPLETE = "complete"
+ABSENT = "absent"
+
+# Đã tải (đang chờ xử lý) hoặc đã xử lý xong -> không tải lại
+DONE_STATUSES = (DOWNLOADED, PROCESSED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hour_status (
+    hour TEXT PRIMARY KEY,         -- yyyymm/dd/hh
+    status TEXT NOT NULL,
+    reason TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS file_status (
+    hour TEXT NOT NULL,
+    name TEXT NOT NULL,            -- remote .nc file name
+    status TEXT NOT NULL,
+    local_path TEXT,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (hour, name)
+);
+CREATE INDEX IF NOT EXISTS idx_hour_status_status ON hour_status (status);
+CREATE INDEX IF NOT EXISTS idx_file_status_status ON file_status (status);
+CREATE TABLE IF NOT EXISTS retry_queue (
+    hour TEXT PRIMARY KEY,
+    attempts INTEGER NOT NULL,
+    next_check REAL NOT NULL,
+    reason TEXT,
+    first_queued REAL NOT NULL     -- when the hour entered the queue; RETRY horizon counts from here
+);
+CREATE INDEX IF NOT EXISTS idx_retry_queue_next_check ON retry_queue (next_check);
+CREATE TABLE IF NOT EXISTS checkpoint (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+CHECKPOINT_FORMAT = "%Y-%m-%d %H:%M"
+
+
+class Himawari_state_store:
+    """Durable per-hour and per-file status of the Himawari downloader"""
+
+    def __init__(self, db_path=STATE_DB):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    def _write(self, sql, params):
+        with self._lock:
+            self._db.execute(sql, params)
+            self._db.commit()
+
+    # --- Hours ---
+    def set_hour_status(self, timestamp, status, reason=None):
+        self._write("INSERT OR REPLACE INTO hour_status VALUES (?, ?, ?, ?)",
+                    (hour_key(timestamp), status, reason, time.time()))
+
+    def hour_status(self, timestamp):
+        with self._lock:
+            row = self._db.execute("SELECT status FROM hour_status WHERE hour = ?",
+                                   (hour_key(timestamp),)).fetchone()
+        return None if row is None else row[0]
+
+    # --- Files ---
+    def mark_listed(self, timestamp, names):
+        """Record remote files of an hour; files that already have a status keep it"""
+        key = hour_key(timestamp)
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO file_status (hour, name, status, updated_at) VALUES (?, ?, ?, ?)",
+                [(key, name, LISTED, now) for name in names])
+            self._db.commit()
+
+    def set_file_status(self, timestamp, name, status, local_path=None, error=None):
+        self._write("INSERT OR REPLACE INTO file_status VALUES (?, ?, ?, ?, ?, ?)",
+                    (hour_key(timestamp), name, status, local_path, error, time.time()))
+
+    def file_statuses(self, timestamp):
+        """{file name: status} for an hour"""
+        with self._lock:
+            rows = self._db.execute("SELECT name, status FROM file_status WHERE hour = ?",
+                                    (hour_key(timestamp),)).fetchall()
+        return dict(rows)
+
+    def done_files(self, timestamp):
+        """Names of files of an hour that are downloaded or processed"""
+        return {name for name, status in self.file_statuses(timestamp).items() if status in DONE_STATUSES}
+
+    def files_with_status(self, status):
+        """[(timestamp, name, local_path)] of all files with the given status"""
+        with self._lock:
+            rows = self._db.execute("SELECT hour, name, local_path FROM file_status WHERE status = ? ORDER BY hour",
+                                    (status,)).fetchall()
+        return [(datetime.strptime(hour, "%Y%m/%d/%H"), name, local_path) for hour, name, local_path in rows]
+
+    # --- Retry queue ---
+    def schedule_retry(self, timestamp, reason, delay):
+        """Queue a missing or failed hour for a re-check in `delay` seconds; an hour already queued keeps its schedule"""
+        now = time.time()
+        self._write("INSERT OR IGNORE INTO retry_queue VALUES (?, 0, ?, ?, ?)",
+                    (hour_key(timestamp), now + delay, reason, now))
+
+    def due_retries(self, limit):
+        """
+        [(timestamp, attempts, queued_seconds)] of queued hours whose re-check time has passed,
+        oldest hour first; queued_seconds is how long the hour has been in the queue.
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT hour, attempts, first_queued FROM retry_queue WHERE next_check <= ? ORDER BY hour LIMIT ?",
+                (now, limit)).fetchall()
+        return [(datetime.strptime(hour, "%Y%m/%d/%H"), attempts, now - first_queued)
+                for hour, attempts, first_queued in rows]
+
+    def reschedule_retry(self, timestamp, delay):
+        """Record one more failed re-check and push the next one `delay` seconds out"""
+        self._write("UPDATE retry_queue SET attempts = attempts + 1, next_check = ? WHERE hour = ?",
+                    (time.time() + delay, hour_key(timestamp)))
+
+    def clear_retry(self, timestamp):
+        self._write("DELETE FROM retry_queue WHERE hour = ?", (hour_key(timestamp),))
+
+    def retry_queue_size(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM retry_queue").fetchone()[0]
+
+    # --- Checkpoint ---
+    def get_checkpoint(self, key="historical_next_hour"):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM checkpoint WHERE key = ?", (key,)).fetchone()
+        return None if row is None else datetime.strptime(row[0], CHECKPOINT_FORMAT)
+
+    def set_checkpoint(self, timestamp, key="historical_next_hour"):
+        self._write("INSERT OR REPLACE INTO checkpoint VALUES (?, ?)",
+                    (key, timestamp.strftime(CHECKPOINT_FORMAT)))
@@ -1,83 +1,144 @@
 import os
 import sys
+import math
+import hashlib
 import rasterio
 import numpy as np
 import xarray as xr
 import geopandas as gpd
-import subprocess
-from rasterio.mask import mask
-
-def nc_to_geotiff(nc_file, output_path):
-    ds = xr.open_dataset(nc_file, decode_timedelta=True)
-    aot = ds['AOT'].values
-    aot_uncertainty = ds['AOT_uncertainty'].values
-    lon = ds['longitude'].values
-    lat = ds['latitude'].values
-    ds.close()
-
-    # Align lưới theo 0.05 độ
-    pixel_size = 0.05
+from rasterio.windows import Window
+from rasterio.features import geometry_mask
+
+from extract_station_aod import extract_station_aod
+
+SHAPEFILE_PATH = "/home/work1/projects/Air_Quality/GADM_Vietnam/gadm41_VNM_0.shp"
+
+# Pixel window và mask của Việt Nam được tính một lần cho mỗi lưới (transform + shape)
+CROP_CACHE_DIR = "/home/work1/projects/Air_Quality/AOD data/crop_cache"
+_crop_cache = {}
+
+PIXEL_SIZE = 0.05
+
+def nc_grid_transform(lon, lat, pixel_size=PIXEL_SIZE):
+    """Geotransform of the Himawari grid, aligned to 0.05 degree"""
     lon_start = np.floor(lon.min() / pixel_size) * pixel_size
     lat_start = np.ceil(lat.max() / pixel_size) * pixel_size
 
-    transform = rasterio.transform.from_origin(
+    return rasterio.transform.from_origin(
         lon_start, lat_start, pixel_size, pixel_size
     )
 
-    # Tạo profile cho file GeoTIFF
+def nc_to_vietnam_geotiff(nc_file, output_path, vietnam_shapefile):
+    """
+    Write the cropped Vietnam GeoTIFF straight from the NetCDF file.
+    The dataset is opened lazily and only the latitude/longitude slab covering Vietnam is read,
+    so the full-disk arrays and the aod_full_*.tif intermediate are never materialised.
+    """
+    with xr.open_dataset(nc_file, decode_timedelta=True) as ds:
+        # Chỉ đọc toạ độ 1 chiều để tính lưới
+        lon = ds['longitude'].values
+        lat = ds['latitude'].values
+        transform = nc_grid_transform(lon, lat)
+        window, outside, out_transform = get_vietnam_crop(transform, ds['AOT'].shape, 'EPSG:4326', vietnam_shapefile)
+
+        rows = slice(window.row_off, window.row_off + window.height)
+        cols = slice(window.col_off, window.col_off + window.width)
+        bands = []
+        for var in ('AOT', 'AOT_uncertainty'):
+            data = ds[var]
+            band = data.isel({data.dims[0]: rows, data.dims[1]: cols}).values.astype('float32', copy=False)
+            # Pixel ngoài biên giới = 0 (như rasterio.mask.mask khi không có nodata)
+            band[outside] = 0
+            bands.append(band)
+
     profile = {
         'driver': 'GTiff',
-        'height': aot.shape[0],
-        'width': aot.shape[1],
-        'count': 2,  # Thay đổi count thành 2 để lưu cả AOT và uncertainty
+        'height': window.height,
+        'width': window.width,
+        'count': 2,
         'dtype': 'float32',
         'crs': 'EPSG:4326',
-        'transform': transform,
+        'transform': out_transform,
     }
 
-    # Ghi cả AOT và uncertainty vào file GeoTIFF
     with rasterio.open(output_path, 'w', **profile) as dst:
-        dst.write(aot.astype('float32'), 1)  # Band 1: AOT
-        dst.write(aot_uncertainty.astype('float32'), 2)  # Band 2: AOT_uncertainty
-
-def crop_to_vietnam(input_tif, output_tif, vietnam_shapefile):
-    with rasterio.open(input_tif) as src:
-        shape = gpd.read_file(vietnam_shapefile)
-        shape = shape.to_crs(src.crs)
-        out_image, out_transform = mask(src, shape.geometry, crop=True)
-        out_meta = src.meta.copy()
-        out_meta.update({
-            "height": out_image.shape[1],
-            "width": out_image.shape[2],
-            "transform": out_transform
-        })
-
-    with rasterio.open(output_tif, "w", **out_meta) as dest:
-        dest.write(out_image)
+        dst.write(bands[0], 1)  # Band 1: AOT
+        dst.write(bands[1], 2)  # Band 2: AOT_uncertainty
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Thiếu file .nc đầu vào")
-        sys.exit(1)
+def _crop_cache_key(transform, shape, crs, vietnam_shapefile):
+    grid = ",".join(f"{v:.9f}" for v in tuple(transform)[:6])
+    key_src = f"{grid}|{shape[0]}x{shape[1]}|{crs}|{os.path.basename(vietnam_shapefile)}"
+    return hashlib.sha1(key_src.encode("utf-8")).hexdigest()[:16]
 
-    nc_path = sys.argv[1]
-    
+def _compute_vietnam_crop(transform, shape, crs, vietnam_shapefile):
+    """Pixel window of the Vietnam bounding box and the mask of pixels outside the border"""
+    shapes = gpd.read_file(vietnam_shapefile).to_crs(crs)
+    left, bottom, right, top = shapes.total_bounds
 
+    inverse = ~transform
+    corners = [inverse * (x, y) for x in (left, right) for y in (bottom, top)]
+    cols = [c for c, _ in corners]
+    rows = [r for _, r in corners]
+    col_start = max(int(math.floor(min(cols))), 0)
+    row_start = max(int(math.floor(min(rows))), 0)
+    col_stop = min(int(math.ceil(max(cols))), shape[1])
+    row_stop = min(int(math.ceil(max(rows))), shape[0])
+
+    window = Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+    window_transform = rasterio.windows.transform(window, transform)
+    # True = ngoài biên giới Việt Nam (giống rasterio.mask.mask)
+    outside = geometry_mask(shapes.geometry, out_shape=(window.height, window.width),
+                            transform=window_transform)
+    return window, outside
+
+def get_vietnam_crop(transform, shape, crs, vietnam_shapefile):
+    """
+    Return (window, outside_mask, window_transform) used to crop a grid to Vietnam.
+    The result is cached in memory and in CROP_CACHE_DIR, keyed by the grid transform and shape.
+    """
+    key = _crop_cache_key(transform, shape, crs, vietnam_shapefile)
+    if key not in _crop_cache:
+        cache_file = os.path.join(CROP_CACHE_DIR, f"crop_{key}.npz")
+        if os.path.exists(cache_file):
+            with np.load(cache_file) as cached:
+                col_off, row_off, width, height = (int(v) for v in cached["window"])
+                outside = cached["mask"]
+            window = Window(col_off, row_off, width, height)
+        else:
+            window, outside = _compute_vietnam_crop(transform, shape, crs, vietnam_shapefile)
+            os.makedirs(CROP_CACHE_DIR, exist_ok=True)
+            tmp_file = cache_file + f".{os.getpid()}.tmp"
+            with open(tmp_file, "wb") as f:
+                np.savez(f, window=np.array([window.col_off, window.row_off, window.width, window.height]),
+                         mask=outside)
+            os.replace(tmp_file, cache_file)
+            print(f"💾 Đã lưu cache crop Việt Nam: {cache_file}")
+        _crop_cache[key] = (window, outside, rasterio.windows.transform(window, transform))
+    return _crop_cache[key]
+
+def process_nc_file(nc_path, shapefile_path=SHAPEFILE_PATH):
+    """
+    Convert one Himawari .nc file to the Vietnam GeoTIFF and update the station AOD outputs.
+    Called in-process by the downloader's worker pool, or via the command line below.
+
+    Returns:
+        str: Path of the cropped aod_vietnam_*.tif file.
+    """
     base_dir = os.path.dirname(nc_path)
     filename = os.path.basename(nc_path).replace(".nc", "")
-    aod_full_path = os.path.join(base_dir, f"aod_full_{filename}.tif")
     aod_vietnam_path = os.path.join(base_dir, f"aod_vietnam_{filename}.tif")
 
-    # print("Path: ", aod_full_path)
+    # Cắt trực tiếp từ NetCDF, không ghi file aod_full_*.tif toàn đĩa
+    nc_to_vietnam_geotiff(nc_path, aod_vietnam_path, shapefile_path)
 
-    shapefile_path = "/home/work1/projects/Air_Quality/GADM_Vietnam/gadm41_VNM_0.shp"
+    os.remove(nc_path)
 
-    nc_to_geotiff(nc_path, aod_full_path)
-    crop_to_vietnam(aod_full_path, aod_vietnam_path, shapefile_path)
+    extract_station_aod(aod_vietnam_path)
+    return aod_vietnam_path
 
-    os.remove(nc_path)
-    os.remove(aod_full_path)
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Thiếu file .nc đầu vào")
+        sys.exit(1)
 
-    
-    EXTRACT_SCRIPT = "/home/work1/projects/Air_Quality/AOD data/extract_station_aod.py"
-    subprocess.run(["python", EXTRACT_SCRIPT, aod_vietnam_path])
\ No newline at end of file
+    process_nc_file(sys.argv[1])
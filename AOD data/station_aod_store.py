@@ -0,0 +1,235 @@
+import os
+import sys
+import glob
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# Kho dữ liệu AOD theo trạm, dạng dài (station_id, timestamp, aot, uncertainty),
+# chia thư mục theo tháng. Mỗi file .nc mới chỉ ghi thêm một file part nhỏ.
+#
+#   STORE_DIR/month=202312/part-20231204_0000.parquet   <- append
+#   STORE_DIR/month=202312/data.parquet                 <- sau khi compact
+STORE_DIR = "/home/slow_data/Air_Quality/AOD/station_aod_store"
+EXPORT_DIR = "/home/slow_data/Air_Quality/AOD/station_aod"
+
+# Chỉ lưu AOT và uncertainty gốc; ngưỡng được áp dụng khi đọc (read_station_aod).
+# Các ngưỡng mặc định của định dạng CSV cũ (all_station{thr}.csv):
+uncertainty_thresholds = [0.5, 0.7, 0.8, 1, 1.2, 1.5]
+
+TIMESTAMP_FORMAT = "%Y%m%d_%H%M"
+COMPACTED_FILE = "data.parquet"
+KEY_COLUMNS = ["station_id", "timestamp"]
+
+
+def legacy_output_file(threshold, output_dir=EXPORT_DIR):
+    """Path of the old wide CSV for one uncertainty threshold"""
+    return os.path.join(output_dir, f"all_station{str(threshold).replace('.', '')}.csv")
+
+
+def month_dir(month, store_dir=STORE_DIR):
+    return os.path.join(store_dir, f"month={month}")
+
+
+def _write_parquet_atomic(df, path):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def append_station_aod(timestamp, station_ids, aot, uncertainty, store_dir=STORE_DIR):
+    """
+    Append the station values of one Himawari timestamp to the store.
+    Cost depends only on the number of stations; an existing part for the same timestamp is replaced.
+
+    Parameters
+    ----------
+    timestamp : str
+        Observation time as in the file name, e.g. "20231204_0000".
+    station_ids, aot, uncertainty : array-like
+        One value per station.
+    """
+    obs_time = datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+    df = pd.DataFrame({
+        "station_id": np.asarray(station_ids, dtype="int64"),
+        "timestamp": pd.Series([obs_time] * len(station_ids), dtype="datetime64[ns]"),
+        "aot": np.asarray(aot, dtype="float32"),
+        "uncertainty": np.asarray(uncertainty, dtype="float32"),
+    })
+
+    out_dir = month_dir(obs_time.strftime("%Y%m"), store_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"part-{timestamp}.parquet")
+    _write_parquet_atomic(df, path)
+    return path
+
+
+def list_months(store_dir=STORE_DIR):
+    months = [os.path.basename(d).removeprefix("month=") for d in glob.glob(os.path.join(store_dir, "month=*"))]
+    return sorted(months)
+
+
+def read_month(month, store_dir=STORE_DIR, filters=None):
+    """
+    All records of one month (compacted file + pending parts), latest write wins.
+    `filters` is passed to the Parquet reader so row groups outside the filter are skipped.
+    """
+    files = sorted(glob.glob(os.path.join(month_dir(month, store_dir), "*.parquet")))
+    if not files:
+        return pd.DataFrame(columns=KEY_COLUMNS + ["aot", "uncertainty"])
+
+    # data.parquet sắp xếp trước các part-* nên part mới hơn sẽ được giữ lại
+    files.sort(key=lambda f: os.path.basename(f) != COMPACTED_FILE)
+    df = pd.concat([pd.read_parquet(f, filters=filters) for f in files], ignore_index=True)
+    return df.drop_duplicates(KEY_COLUMNS, keep="last")
+
+
+def compact_month(month, store_dir=STORE_DIR):
+    """Merge the part files of one month into a single sorted data.parquet"""
+    out_dir = month_dir(month, store_dir)
+    parts = glob.glob(os.path.join(out_dir, "part-*.parquet"))
+    if not parts:
+        return 0
+
+    df = read_month(month, store_dir).sort_values(["timestamp", "station_id"], ignore_index=True)
+    _write_parquet_atomic(df, os.path.join(out_dir, COMPACTED_FILE))
+    for part in parts:
+        os.remove(part)
+    print(f"🗜️ Đã compact {len(parts)} part của tháng {month} ({len(df)} dòng)")
+    return len(parts)
+
+
+def compact(store_dir=STORE_DIR, skip_current_month=True):
+    """Compact every month in the store; the month still being written is skipped by default"""
+    current_month = datetime.now().strftime("%Y%m")
+    for month in list_months(store_dir):
+        if skip_current_month and month == current_month:
+            continue
+        compact_month(month, store_dir)
+
+
+def read_range(start=None, end=None, station_ids=None, store_dir=STORE_DIR):
+    """Records with start <= timestamp < end (None = open-ended), optionally for some stations only"""
+    months = list_months(store_dir)
+    if start is not None:
+        months = [m for m in months if m >= start.strftime("%Y%m")]
+    if end is not None:
+        months = [m for m in months if m <= end.strftime("%Y%m")]
+    if not months:
+        return pd.DataFrame(columns=KEY_COLUMNS + ["aot", "uncertainty"])
+
+    filters = []
+    if start is not None:
+        filters.append(("timestamp", ">=", pd.Timestamp(start)))
+    if end is not None:
+        filters.append(("timestamp", "<", pd.Timestamp(end)))
+    if station_ids is not None:
+        filters.append(("station_id", "in", [int(i) for i in station_ids]))
+
+    df = pd.concat([read_month(m, store_dir, filters or None) for m in months], ignore_index=True)
+    return df.sort_values(["timestamp", "station_id"], ignore_index=True)
+
+
+def apply_uncertainty_thresholds(aot, uncertainty, thresholds):
+    """
+    Mask AOT by uncertainty for several thresholds at once.
+
+    Returns:
+        np.ndarray: shape (len(thresholds), len(aot)); NaN where AOT is missing
+        or uncertainty is missing or >= the threshold.
+    """
+    uncertainty = np.asarray(uncertainty)
+    # Thresholds in the uncertainty dtype (float32), like the per-station code: a pixel at exactly 0.7 is excluded
+    thresholds = np.asarray(thresholds, dtype=uncertainty.dtype)[:, np.newaxis]
+    keep = ~np.isnan(aot) & (uncertainty < thresholds)  # NaN uncertainty so sánh luôn False
+    return np.where(keep, aot, np.nan)
+
+
+def threshold_column(threshold):
+    """Column name of the AOT masked by one uncertainty threshold, e.g. aot_0.5"""
+    return f"aot_{threshold}"
+
+
+def read_station_aod(start=None, end=None, thresholds=None, station_ids=None, store_dir=STORE_DIR):
+    """
+    Read station AOD with uncertainty thresholds applied at read time.
+    Any threshold can be used without reprocessing the archive, since only the raw AOT
+    and uncertainty are stored.
+
+    Parameters
+    ----------
+    start, end : datetime, optional
+        Time range, start <= timestamp < end.
+    thresholds : float or list of float, optional
+        For each threshold a column aot_<threshold> is added, holding AOT where
+        uncertainty < threshold and NaN elsewhere.
+    station_ids : list, optional
+        Only read these stations.
+
+    Returns
+    -------
+    pd.DataFrame
+        Long format: station_id, timestamp, aot, uncertainty [, aot_<threshold> ...].
+    """
+    df = read_range(start, end, station_ids, store_dir)
+    if thresholds is None:
+        return df
+    if np.isscalar(thresholds):
+        thresholds = [thresholds]
+
+    masked = apply_uncertainty_thresholds(df["aot"].values.astype("float32"),
+                                          df["uncertainty"].values.astype("float32"), thresholds)
+    return df.assign(**{threshold_column(t): values for t, values in zip(thresholds, masked)})
+
+
+def export_wide(stations, thresholds=None, start=None, end=None, output_dir=EXPORT_DIR, store_dir=STORE_DIR):
+    """
+    Write the old wide layout (all_station{thr}.csv, one AOT_<timestamp> column per hour)
+    for each threshold, from a single read of the store.
+
+    Parameters
+    ----------
+    stations : pd.DataFrame
+        Station list with station_id, station_name, latitude and longitude.
+    """
+    thresholds = thresholds or uncertainty_thresholds
+    df = read_station_aod(start, end, thresholds, store_dir=store_dir)
+    columns = [threshold_column(t) for t in thresholds]
+    wide_all = df.pivot(index="station_id", columns="timestamp", values=columns)
+
+    output_files = []
+    for threshold, column in zip(thresholds, columns):
+        wide = wide_all[column].sort_index(axis=1)
+        wide.columns = [f"AOT_{t.strftime(TIMESTAMP_FORMAT)}" for t in wide.columns]
+        out = stations[["station_id", "station_name", "latitude", "longitude"]].merge(
+            wide, left_on="station_id", right_index=True, how="left")
+
+        output_csv = legacy_output_file(threshold, output_dir)
+        os.makedirs(output_dir, exist_ok=True)
+        out.to_csv(output_csv, index=False)
+        print(f"📤 Đã xuất {output_csv} ({wide.shape[1]} mốc thời gian)")
+        output_files.append(output_csv)
+    return output_files
+
+
+if __name__ == "__main__":
+    # python station_aod_store.py compact [yyyymm]
+    # python station_aod_store.py export [threshold ...]
+    if len(sys.argv) < 2 or sys.argv[1] not in ("compact", "export"):
+        print("Cách dùng: station_aod_store.py compact [yyyymm] | export [threshold ...]")
+        sys.exit(1)
+
+    if sys.argv[1] == "compact":
+        if len(sys.argv) > 2:
+            compact_month(sys.argv[2])
+        else:
+            compact()
+    else:
+        # Add the parent directory to sys.path (for util)
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+        from util.stations import get_stations
+
+        # "1" -> 1 để giữ tên file cũ all_station1.csv
+        thresholds = [int(float(t)) if float(t).is_integer() else float(t) for t in sys.argv[2:]]
+        export_wide(get_stations(), thresholds or None)
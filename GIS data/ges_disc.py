@@ -9,8 +9,44 @@ sys.path.append(parent_dir)
 
 print(sys.path)
 
-import subprocess
+import json
+import threading
+from urllib.parse import urlparse, parse_qs
 from config.config import earthdata_config
+from util import earthdata
+PARALLEL_DOWNLOADS = 8  # Concurrent transfers sharing one Earthdata session
+MANIFEST_NAME = ".gesdisc_manifest.json"  # Completed URLs and sizes, kept in target_dir
+MANIFEST_SAVE_EVERY = 50  # Completed files between manifest writes
+
+
+def url_filename(url):
+    """Local file name of a GES DISC URL: the LABEL of OPeNDAP/subset URLs, else the path basename"""
+    parsed = urlparse(url)
+    label = parse_qs(parsed.query).get("LABEL")
+    return label[0] if label else os.path.basename(parsed.path)
+
+
+def load_manifest(target_dir):
+    path = os.path.join(target_dir, MANIFEST_NAME)
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def save_manifest(target_dir, manifest):
+    path = os.path.join(target_dir, MANIFEST_NAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def is_done(entry, target_dir):
+    """True if a manifest entry's file is still on disk with the recorded size"""
+    path = os.path.join(target_dir, entry["file"])
+    return os.path.exists(path) and os.path.getsize(path) == entry["size"]
+
 
 def download_gesdisc_imerg(
     urls_txt,
@@ -18,11 +54,14 @@ def download_gesdisc_imerg(
     username,
     password,
     cookie_file=os.path.expanduser("/home/work1/.urs_cookies"),
-    curl_path="curl"
+    workers=PARALLEL_DOWNLOADS,
 ):
     """
     Downloads NASA GES DISC (e.g., IMERG) data requiring Earthdata authentication,
-    using curl instead of wget.
+    `workers` files at a time over one shared, authenticated HTTP session.
+
+    URLs recorded in the manifest (target_dir/.gesdisc_manifest.json) whose file is
+    still on disk with the same size are skipped, so a rerun only fetches what is missing.
 
     Parameters
     ----------
@@ -36,46 +75,61 @@ def download_gesdisc_imerg(
         Your Earthdata password.
     cookie_file : str, optional
         Path to cookie file (default /home/work1/.urs_cookies).
-    curl_path : str, optional
-        Path to curl executable.
+    workers : int, optional
+        Number of parallel transfers (default PARALLEL_DOWNLOADS).
+
+    Returns
+    -------
+    tuple
+        (downloaded, skipped, failed) counts.
     """
 
     os.makedirs(target_dir, exist_ok=True)
     os.makedirs(os.path.dirname(cookie_file), exist_ok=True)
 
-    # Ensure cookie file exists
-    if not os.path.exists(cookie_file):
-        open(cookie_file, "a").close()
-
-    # Base curl command template
-    base_cmd = [
-        curl_path,
-        "-n",  # use .netrc if present (optional)
-        "-L",  # follow redirects
-        "--cookie", cookie_file,
-        "--cookie-jar", cookie_file,
-        # "--user", f"{username}:{password}",
-        "--fail",  # fail on HTTP errors
-        "--remote-name",  # save using the remote filename
-        "--remote-header-name",  # use server-provided name if available
-        "--insecure",  # skip SSL check if needed
-    ]
-
     # Read URLs from file
     with open(urls_txt, "r") as f:
         urls = [line.strip() for line in f if line.strip() and not line.startswith("#")]
 
-    for url in urls:
-        print(f"➡️  Downloading: {url}")
-        cmd = base_cmd + ["--output-dir", target_dir, url]
-        try:
-            result = subprocess.run(cmd, check=False)
-            if result.returncode != 0:
-                print(f"⚠️  Warning: curl returned code {result.returncode} for {url}")
-        except Exception as e:
-            print(f"❌ Error while downloading {url}: {e}", file=sys.stderr)
-
-    print("\n✅ All downloads attempted. Check above messages for any failures.")
+    manifest = load_manifest(target_dir)
+    pending = [url for url in urls if not (url in manifest and is_done(manifest[url], target_dir))]
+    skipped = len(urls) - len(pending)
+    print(f"📋 {len(urls)} URLs: {skipped} already downloaded, {len(pending)} to fetch")
+    if not pending:
+        return 0, skipped, 0
+
+    # One in-process client: pooled connections, URS login once, cookies shared by all transfers
+    engine = earthdata.get_client("gesdisc", username=username, password=password,
+                                  cookie_file=cookie_file, max_connections=workers)
+    manifest_lock = threading.Lock()
+    completed = [0]
+
+    def fetch(url):
+        filename = url_filename(url)
+        size = engine.download(url, os.path.join(target_dir, filename))
+        with manifest_lock:
+            manifest[url] = {"file": filename, "size": size}
+            completed[0] += 1
+            if completed[0] % MANIFEST_SAVE_EVERY == 0:
+                save_manifest(target_dir, manifest)
+        return filename
+
+    futures = {url: engine.submit(fetch, url) for url in pending}
+    failed = 0
+    try:
+        for url, future in futures.items():
+            try:
+                print(f"✅ Downloaded: {future.result()}")
+            except Exception as e:
+                failed += 1
+                print(f"❌ Error while downloading {url}: {e}", file=sys.stderr)
+    finally:
+        with manifest_lock:
+            save_manifest(target_dir, manifest)
+        engine.session.save_cookies()
+
+    print(f"\n✅ Downloaded {len(pending) - failed}, skipped {skipped}, failed {failed}.")
+    return len(pending) - failed, skipped, failed
 
 
 if __name__ == "__main__":
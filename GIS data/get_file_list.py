@@ -10,9 +10,14 @@ import subprocess
 import re
 from datetime import datetime, timedelta
 import time
+import hashlib
 from ftplib import FTP_TLS, error_temp, error_perm
 import ssl
+from concurrent.futures import ThreadPoolExecutor
 from config.config import gis_config
+from util.ftp_pool import FTP_session_pool, retr_resumable
+from util.file_catalog import File_catalog
+import process_imerg_gis
 
 FTP_TLS.ssl_version = ssl.PROTOCOL_TLSv1_2
 
@@ -25,8 +30,13 @@ START_DATE_STR = "2025-06-30"
 print(f"📅 Using date: {START_DATE_STR}")
 
 CHECK_INTERVAL = 6 * 60 * 60  # every 6 hours
-RECONNECT_AFTER_FILES = 50  # Reconnect after every N files
+RECONNECT_AFTER_FILES = 50  # Reconnect a session after every N files
+RECONNECT_AFTER_SECONDS = 30 * 60  # ... or after it has been open this long
 MAX_RETRIES = 3  # Maximum retry attempts for operations
+FTP_SESSIONS = 4  # FTPS sessions downloading a day's files concurrently
+PROCESS_AFTER_DOWNLOAD = True  # Convert each downloaded day with process_imerg_gis.py
+PRODUCT = 'IMERG_HHR_GIS'
+CATALOG_SOURCE = 'imerg_gis'  # Downloaded zips are recorded in the shared file catalog
 
 # --- Helper Function for FTPS Connection ---
 def connect_ftps():
@@ -58,17 +68,29 @@ def connect_ftps():
         return None
 
 
-def is_connection_alive(ftps):
-    """Check if FTPS connection is still alive."""
-    try:
-        ftps.voidcmd("NOOP")
-        return True
-    except:
-        return False
+# Each session keeps its working directory between files and is replaced according to
+# the reconnect policy (RECONNECT_AFTER_FILES / RECONNECT_AFTER_SECONDS)
+ftp_pool = FTP_session_pool(connect_ftps, max_size=FTP_SESSIONS,
+                            max_uses=RECONNECT_AFTER_FILES, max_age=RECONNECT_AFTER_SECONDS)
+_file_executor = ThreadPoolExecutor(max_workers=FTP_SESSIONS, thread_name_prefix="gis-file")
+# Days are processed one at a time on their own thread, so the next day's transfers do not wait
+_process_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gis-process")
+_catalog = None
+
+
+def get_catalog():
+    """Return the shared file catalog, opening its database on first use"""
+    global _catalog
+    if _catalog is None:
+        _catalog = File_catalog()
+    return _catalog
 
 
-def download_for_date(ftps, date_obj):
-    """Download files for a specific date. Returns (success, files_downloaded)."""
+def download_for_date(date_obj):
+    """
+    Download files for a specific date, FTP_SESSIONS at a time. Returns (success, files_downloaded).
+    Raises the first download error after the other files of the day have finished.
+    """
     year = date_obj.strftime('%Y')
     month = date_obj.strftime('%m')
     day = date_obj.strftime('%d')
@@ -76,7 +98,7 @@ def download_for_date(ftps, date_obj):
     remote_path = f'/gpmdata/{year}/{month}/{day}/gis/'
 
     # Get the list of files (basenames)
-    file_list = get_file_list(ftps, remote_path)
+    file_list = get_file_list(remote_path)
     
     if not file_list:
         print("ℹ️ No matching HHR .zip files found.")
@@ -85,27 +107,49 @@ def download_for_date(ftps, date_obj):
     local_path = os.path.join(DOWNLOAD_DIR, year, month, day)
     os.makedirs(local_path, exist_ok=True)
 
-    files_downloaded = 0
-    # Loop through and download each file
-    for filename in file_list:
-        success = get_file(ftps, remote_path, filename, local_path)
-        if success:
-            files_downloaded += 1
-    
+    # One indexed catalog query instead of an exists() check per file on /home/slow_data
+    existing = get_catalog().existing(CATALOG_SOURCE, file_list)
+    if existing:
+        print(f"⏭️ {len(existing)} files already downloaded, skipping.")
+    futures = [_file_executor.submit(get_file, remote_path, filename, local_path)
+               for filename in file_list if filename not in existing]
+
+    files_downloaded = len(existing)
+    first_error = None
+    for future in futures:
+        try:
+            if future.result():
+                files_downloaded += 1
+        except Exception as e:
+            first_error = first_error or e
+
+    if first_error is not None:
+        raise first_error
+
+    if PROCESS_AFTER_DOWNLOAD:
+        _process_executor.submit(process_downloaded_day, local_path, date_obj)
+
     return True, files_downloaded
 
 
-def get_file_list(ftps: FTP_TLS, remote_path: str):
-    """Get the file listing for the given remote path using the FTPS connection."""
+def process_downloaded_day(local_path, date_obj):
+    """Read the day's zips in place (/vsizip/) into station and daily precipitation (processing thread)"""
+    try:
+        if process_imerg_gis.needs_processing(local_path):
+            process_imerg_gis.process_day(local_path)
+    except Exception as e:
+        print(f"⚠️ Processing failed for {date_obj.date()}: {e}")
+
+
+def get_file_list(remote_path: str):
+    """Get the file listing for the given remote path using a pooled FTPS session."""
     print(f"📡 Fetching file list from {remote_path}")
     
     for attempt in range(MAX_RETRIES):
         try:
-            # Always use absolute path and change directory fresh
-            ftps.cwd('/')  # Reset to root first
-            ftps.cwd(remote_path)
-            
-            raw_listing = ftps.nlst()
+            with ftp_pool.session() as ftps:
+                ftp_pool.chdir(ftps, remote_path)
+                raw_listing = ftps.nlst()
             
             # Filter for .zip links containing 'HHR'
             pattern = re.compile(r'.*HHR.*\.zip', re.IGNORECASE)
@@ -136,35 +180,30 @@ def get_file_list(ftps: FTP_TLS, remote_path: str):
     return []
 
 
-def get_file(ftps: FTP_TLS, remote_path: str, filename: str, local_path: str):
-    """Download a file from the FTPS server with retry logic."""
+def get_file(remote_path: str, filename: str, local_path: str):
+    """Download a file over a pooled FTPS session with retry logic."""
     output_path = os.path.join(local_path, filename)
 
-    if os.path.exists(output_path):
-        print(f"⏭️ File already exists, skipping: {filename}")
-        return True
-
     print(f"⬇️ Downloading: {filename} to {output_path}")
 
     for attempt in range(MAX_RETRIES):
         try:
-            # Ensure we're in the right directory
-            ftps.cwd('/')
-            ftps.cwd(remote_path)
-            
-            with open(output_path, 'wb') as local_file:
-                ftps.retrbinary(f'RETR {filename}', local_file.write)
+            # The session only changes directory when it is not already in remote_path
+            # A failed attempt leaves a .part file that the next attempt resumes with REST
+            # The checksum is computed while the file streams in
+            digest = hashlib.md5()
+            with ftp_pool.session() as ftps:
+                ftp_pool.chdir(ftps, remote_path)
+                retr_resumable(ftps, filename, output_path, digest=digest)
                 
+            get_catalog().record(CATALOG_SOURCE, filename, output_path, os.path.getsize(output_path),
+                                 process_imerg_gis.hhr_timestamp(filename), product=PRODUCT, checksum=digest.hexdigest())
             print(f"✅ Downloaded: {filename}")
             return True
             
         except Exception as e:
             print(f"❌ Download failed (attempt {attempt + 1}/{MAX_RETRIES}): {filename}. Error: {e}")
             
-            # Clean up potentially incomplete file
-            if os.path.exists(output_path):
-                os.remove(output_path)
-            
             if attempt < MAX_RETRIES - 1:
                 time.sleep(2 ** attempt)  # Exponential backoff
             else:
@@ -175,82 +214,35 @@ def get_file(ftps: FTP_TLS, remote_path: str, filename: str, local_path: str):
 
 
 def download_historical_data():
-    """Download historical data with automatic reconnection."""
+    """Download historical data; sessions are reconnected by the pool as needed."""
     try:
         current_date = datetime.strptime(START_DATE_STR, '%Y-%m-%d')
     except ValueError:
         print("Error: Invalid date format. Please use YYYY-MM-DD.")
         sys.exit(1)
-    
-    ftps = connect_ftps()
-    if not ftps:
-        print("❌ Failed to establish initial connection.")
-        sys.exit(1)
-    
-    last_connection_time = time.time()
-    files_since_reconnect = 0
-    reconnect_interval_seconds = 30 * 60  # 30 minutes
 
     while True:
-        # Check if we need to reconnect
-        current_time = time.time()
-        time_since_connection = current_time - last_connection_time
-        
-        if (files_since_reconnect >= RECONNECT_AFTER_FILES or 
-            time_since_connection >= reconnect_interval_seconds or
-            not is_connection_alive(ftps)):
-            
-            print(f"🔄 Reconnecting (files: {files_since_reconnect}, time: {time_since_connection/60:.1f}min)")
-            try:
-                ftps.quit()
-            except:
-                pass
-            
-            ftps = connect_ftps()
-            if not ftps:
-                print("❌ Reconnection failed. Retrying in 60 seconds...")
-                time.sleep(60)
-                continue
-                
-            last_connection_time = time.time()
-            files_since_reconnect = 0
-
         # Try to download for current date
         try:
-            found, num_files = download_for_date(ftps, current_date)
+            found, num_files = download_for_date(current_date)
             
             if not found:
                 print(f"🚫 No more GIS data found. Reached latest date: {current_date.date()}")
                 break
                 
-            files_since_reconnect += num_files
             current_date += timedelta(days=1)
             
+        except ConnectionError as e:
+            print(f"❌ Connection failed: {e}. Retrying in 60 seconds...")
+            time.sleep(60)
+            continue  # Retry same date
+
         except Exception as e:
             print(f"❌ Error processing {current_date.date()}: {e}")
-            print("🔄 Will reconnect and retry...")
-            
-            try:
-                ftps.quit()
-            except:
-                pass
-                
-            ftps = connect_ftps()
-            if not ftps:
-                print("❌ Reconnection failed. Retrying in 60 seconds...")
-                time.sleep(60)
-            else:
-                last_connection_time = time.time()
-                files_since_reconnect = 0
-            
+            print("🔄 Will retry with fresh sessions...")
             continue  # Retry same date
-    
-    if ftps:
-        try:
-            ftps.quit()
-        except:
-            pass
-            
+
+    ftp_pool.close_all()
     return current_date
 
 
@@ -261,19 +253,13 @@ def check_for_updates(start_from_date):
     while True:
         print(f"\n⏰ Scheduled check at {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')}")
         
-        ftps = connect_ftps()
-        if not ftps:
-            print("❌ Failed to connect. Retrying in 10 minutes...")
-            time.sleep(600)
-            continue
-        
         next_date = last_checked_date
         new_data_found = False
 
         try:
             # Keep checking sequential dates until no data found
             while True:
-                found, _ = download_for_date(ftps, next_date)
+                found, _ = download_for_date(next_date)
                 if not found:
                     break
                 new_data_found = True
@@ -284,10 +270,8 @@ def check_for_updates(start_from_date):
             print(f"⚠️ Error during update check: {e}")
         
         finally:
-            try:
-                ftps.quit()
-            except:
-                pass
+            # Idle sessions would time out during the sleep anyway
+            ftp_pool.close_all()
 
         if new_data_found:
             print(f"✅ Updated through {last_checked_date.date()}")
@@ -299,6 +283,11 @@ def check_for_updates(start_from_date):
 
 
 if __name__ == '__main__':
+    # Catalog the zips downloaded before the catalog existed (first run only)
+    if get_catalog().count(CATALOG_SOURCE) == 0:
+        get_catalog().bootstrap(CATALOG_SOURCE, DOWNLOAD_DIR, process_imerg_gis.hhr_timestamp,
+                                product=PRODUCT, pattern='*HHR*.zip')
+
     print(f"📅 Starting historical download from {START_DATE_STR}")
     latest_date = download_historical_data()
     print(f"🔁 Switching to scheduled update mode after {latest_date.date()}")
@@ -0,0 +1,226 @@
+import os
+import re
+import sys
+# Get the absolute path of the current script's directory
+current_script_dir = os.path.dirname(os.path.abspath(__file__))
+# Add the parent directory to sys.path (for util)
+sys.path.append(os.path.join(current_script_dir, os.pardir))
+import glob
+import zipfile
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.windows import Window, from_bounds
+
+from util.stations import get_stations, station_pixel_indices
+
+################################################################################
+# IMERG GIS HHR zips -> station and daily precipitation
+#
+# The 30-minute GeoTIFF is read straight out of each zip through GDAL's /vsizip/,
+# cropped to the Vietnam window, and sampled at the stations. Nothing is extracted
+# to disk. Per day this writes:
+#
+#   STORE_DIR/month=202506/part-20250630.parquet         station_id, timestamp, precip (mm/hr)
+#   DAILY_DIR/2025/imerg_daily_vietnam_20250630.tif       daily accumulation (mm) on the Vietnam window
+################################################################################
+
+DOWNLOAD_DIR = r'/home/slow_data/Air_Quality/GIS'
+STORE_DIR = r'/home/slow_data/Air_Quality/GIS/station_precip'
+DAILY_DIR = r'/home/slow_data/Air_Quality/GIS/daily_vietnam'
+SHAPEFILE_PATH = r'/home/work1/projects/Air_Quality/GADM_Vietnam/gadm41_VNM_0.shp'
+
+TIF_SUFFIX = '30min.tif'  # Each HHR zip holds the half-hour rate GeoTIFF (plus sidecar files)
+PRECIP_SCALE = 0.1  # GeoTIFF counts are 0.1 mm/hr
+SLOT_HOURS = 0.5
+SLOTS_PER_DAY = 48
+
+HHR_TIME = re.compile(r'(\d{8})-S(\d{6})')
+
+_vietnam_bounds = None
+_window_cache = {}
+
+
+def vietnam_bounds(shapefile=SHAPEFILE_PATH):
+    """(left, bottom, right, top) of Vietnam, read from the GADM shapefile once"""
+    global _vietnam_bounds
+    if _vietnam_bounds is None:
+        import geopandas as gpd
+        _vietnam_bounds = tuple(gpd.read_file(shapefile).to_crs("EPSG:4326").total_bounds)
+    return _vietnam_bounds
+
+
+def vietnam_window(transform, shape):
+    """Pixel window of the Vietnam bounding box on a grid, computed once per grid"""
+    key = (tuple(transform)[:6], tuple(shape))
+    if key not in _window_cache:
+        window = from_bounds(*vietnam_bounds(), transform=transform)
+        window = window.round_offsets(op="floor").round_lengths(op="ceil")
+        _window_cache[key] = window.intersection(Window(0, 0, shape[1], shape[0]))
+    return _window_cache[key]
+
+
+def hhr_timestamp(zip_path):
+    """Start time of the half-hour slot, from e.g. 3B-HHR-L.MS.MRG.3IMERG.20250630-S000000-E002959..., or None"""
+    match = HHR_TIME.search(os.path.basename(zip_path))
+    if match is None:
+        return None
+    try:
+        return datetime.strptime(match.group(1) + match.group(2), "%Y%m%d%H%M%S")
+    except ValueError:
+        return None
+
+
+def day_zips(day_dir):
+    """[(slot start, path)] of the HHR zips of a day folder, oldest first; names without a slot time are skipped"""
+    zips = [(hhr_timestamp(path), path) for path in glob.glob(os.path.join(day_dir, '*HHR*.zip'))]
+    return sorted((timestamp, path) for timestamp, path in zips if timestamp is not None)
+
+
+def vsizip_path(zip_path):
+    """GDAL path of the half-hour GeoTIFF inside a zip, without extracting it"""
+    with zipfile.ZipFile(zip_path) as zf:
+        members = [name for name in zf.namelist() if name.endswith(TIF_SUFFIX)]
+    if not members:
+        raise FileNotFoundError(f"No *{TIF_SUFFIX} in {zip_path}")
+    return f"/vsizip/{zip_path}/{members[0]}"
+
+
+def read_vietnam_precip(zip_path):
+    """
+    Precipitation rate (mm/hr) on the Vietnam window of one HHR zip, NaN where missing.
+
+    Returns:
+        tuple: (array, window transform)
+    """
+    with rasterio.open(vsizip_path(zip_path)) as src:
+        window = vietnam_window(src.transform, src.shape)
+        counts = src.read(1, window=window)
+        transform = src.window_transform(window)
+        nodata = src.nodata
+
+    precip = counts.astype("float32") * PRECIP_SCALE
+    missing = counts < 0
+    if nodata is not None:
+        missing |= counts == nodata
+    precip[missing] = np.nan
+    return precip, transform
+
+
+def process_day(day_dir, stations=None, store_dir=STORE_DIR, daily_dir=DAILY_DIR):
+    """
+    Read every HHR zip of one day folder ({yyyy}/{mm}/{dd}) and write the station
+    half-hourly values and the daily accumulation.
+
+    Returns:
+        dict: {"station": DataFrame, "daily": array (mm), "slots": int} or None if the day has no zips.
+    """
+    if stations is None:
+        stations = get_stations()
+    zips = day_zips(day_dir)
+    if not zips:
+        return None
+
+    daily = None
+    valid_slots = None
+    frames = []
+    for timestamp, zip_path in zips:
+        try:
+            precip, transform = read_vietnam_precip(zip_path)
+        except Exception as e:
+            print(f"⚠️ Skipping unreadable {os.path.basename(zip_path)}: {e}")
+            continue
+
+        rows, cols, inside = station_pixel_indices(transform, precip.shape,
+                                                   stations["longitude"].values, stations["latitude"].values)
+        values = np.full(len(stations), np.nan, dtype="float32")
+        values[inside] = precip[rows[inside], cols[inside]]
+        frames.append(pd.DataFrame({
+            "station_id": stations["station_id"].values.astype("int64"),
+            "timestamp": pd.Series([timestamp] * len(stations), dtype="datetime64[ns]"),
+            "precip": values,
+        }))
+
+        if daily is None:
+            daily = np.zeros(precip.shape, dtype="float32")
+            valid_slots = np.zeros(precip.shape, dtype="int16")
+            daily_transform = transform
+        has_value = ~np.isnan(precip)
+        daily[has_value] += precip[has_value] * SLOT_HOURS
+        valid_slots += has_value
+
+    if not frames:
+        return None
+    daily[valid_slots == 0] = np.nan
+
+    date_obj = zips[0][0]
+    station_df = pd.concat(frames, ignore_index=True)
+    _write_station_part(station_df, date_obj, store_dir)
+    _write_daily_tif(daily, daily_transform, date_obj, len(frames), daily_dir)
+    return {"station": station_df, "daily": daily, "slots": len(frames)}
+
+
+def station_output_file(date_obj, store_dir=STORE_DIR):
+    return os.path.join(store_dir, f"month={date_obj.strftime('%Y%m')}", f"part-{date_obj.strftime('%Y%m%d')}.parquet")
+
+
+def daily_output_file(date_obj, daily_dir=DAILY_DIR):
+    return os.path.join(daily_dir, date_obj.strftime('%Y'), f"imerg_daily_vietnam_{date_obj.strftime('%Y%m%d')}.tif")
+
+
+def _write_station_part(df, date_obj, store_dir):
+    output_file = station_output_file(date_obj, store_dir)
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    tmp_file = f"{output_file}.{os.getpid()}.tmp"
+    df.to_parquet(tmp_file, index=False)
+    os.replace(tmp_file, output_file)
+
+
+def _write_daily_tif(daily, transform, date_obj, slots, daily_dir):
+    output_file = daily_output_file(date_obj, daily_dir)
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    tmp_file = f"{output_file}.{os.getpid()}.tmp"
+    profile = {
+        "driver": "GTiff", "height": daily.shape[0], "width": daily.shape[1], "count": 1,
+        "dtype": "float32", "crs": "EPSG:4326", "transform": transform, "nodata": np.nan, "compress": "deflate",
+    }
+    with rasterio.open(tmp_file, "w", **profile) as dst:
+        dst.write(daily, 1)
+        dst.update_tags(units="mm", slots=str(slots), slots_expected=str(SLOTS_PER_DAY))
+    os.replace(tmp_file, output_file)
+
+
+def needs_processing(day_dir, store_dir=STORE_DIR):
+    """True if a day folder has zips and its station output is missing or older than the newest zip"""
+    zips = day_zips(day_dir)
+    if not zips:
+        return False
+    output_file = station_output_file(zips[0][0], store_dir)
+    return not os.path.exists(output_file) or os.path.getmtime(output_file) < max(os.path.getmtime(p) for _, p in zips)
+
+
+def process_range(first_date, last_date, download_dir=DOWNLOAD_DIR):
+    """Process every downloaded day in [first_date, last_date] without up-to-date output"""
+    processed = 0
+    date = first_date
+    while date <= last_date:
+        day_dir = os.path.join(download_dir, date.strftime('%Y'), date.strftime('%m'), date.strftime('%d'))
+        if needs_processing(day_dir):
+            result = process_day(day_dir)
+            if result is not None:
+                processed += 1
+                print(f"🌧️ {date.strftime('%Y-%m-%d')}: {result['slots']}/{SLOTS_PER_DAY} half-hours")
+        date += timedelta(days=1)
+    return processed
+
+
+if __name__ == "__main__":
+    # python process_imerg_gis.py YYYY-MM-DD [YYYY-MM-DD]
+    if len(sys.argv) < 2:
+        print("Usage: process_imerg_gis.py START_DATE [END_DATE]")
+        sys.exit(1)
+    start = datetime.strptime(sys.argv[1], "%Y-%m-%d")
+    end = datetime.strptime(sys.argv[2], "%Y-%m-%d") if len(sys.argv) > 2 else datetime.now()
+    process_range(start, end)
@@ -7,90 +7,24 @@ parent_dir = os.path.join(current_script_dir, os.pardir)
 # Add the parent directory to sys.path
 sys.path.append(parent_dir)
 
-import shutil
 from datetime import datetime, timedelta
 import time
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
 from config.config import modis_config
+from util import earthdata
+from util.file_catalog import File_catalog, file_md5
+import process_modis_lst
 
 try:
     from StringIO import StringIO   # python2
 except ImportError:
     from io import StringIO         # python3
 
-################################################################################
-# NASA LAADS DAAC Download Functions (from official script)
-################################################################################
-
 USERAGENT = 'tis/download.py_1.0--' + sys.version.replace('\n','').replace('\r','')
 
-def getcURL(url, headers=None, out=None):
-    """Fallback to cURL when Python SSL doesn't support TLSv1.1+"""
-    import subprocess
-    try:
-        print('  Using cURL fallback', file=sys.stderr)
-        args = ['curl', '--fail', '-sS', '-L', '-b', 'session', '--get', url]
-        for (k,v) in headers.items():
-            args.extend(['-H', ': '.join([k, v])])
-        if out is None:
-            result = subprocess.check_output(args)
-            return result.decode('utf-8') if isinstance(result, bytes) else result
-        else:
-            subprocess.call(args, stdout=out)
-    except subprocess.CalledProcessError as e:
-        print('cURL GET error: %s' % (e.message if hasattr(e, 'message') else str(e)), file=sys.stderr)
-    return None
-
-def geturl(url, token=None, out=None):
-    """Read the specified URL and output to a file or return content"""
-    headers = {'user-agent': USERAGENT}
-    if token is not None:
-        headers['Authorization'] = 'Bearer ' + token
-    
-    try:
-        import ssl
-        try:
-            CTX = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
-            CTX.minimum_version = ssl.TLSVersion.TLSv1_2
-        except AttributeError:
-            # Fallback for older Python versions
-            CTX = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
-        
-        if sys.version_info.major == 2:
-            import urllib2
-            try:
-                fh = urllib2.urlopen(urllib2.Request(url, headers=headers), context=CTX)
-                if out is None:
-                    return fh.read()
-                else:
-                    shutil.copyfileobj(fh, out)
-            except urllib2.HTTPError as e:
-                print('HTTP GET error code: %d' % e.code, file=sys.stderr)
-                return getcURL(url, headers, out)
-            except urllib2.URLError as e:
-                print('Failed to make request: %s' % e.reason, file=sys.stderr)
-                return getcURL(url, headers, out)
-            return None
-        else:
-            from urllib.request import urlopen, Request, URLError, HTTPError
-            try:
-                fh = urlopen(Request(url, headers=headers), context=CTX)
-                if out is None:
-                    return fh.read().decode('utf-8')
-                else:
-                    shutil.copyfileobj(fh, out)
-            except HTTPError as e:
-                print('HTTP GET error code: %d' % e.code, file=sys.stderr)
-                return getcURL(url, headers, out)
-            except URLError as e:
-                print('Failed to make request: %s' % e.reason, file=sys.stderr)
-                return getcURL(url, headers, out)
-            return None
-    
-    except AttributeError:
-        return getcURL(url, headers, out)
-
-################################################################################
-
 SERVER = 'https://ladsweb.modaps.eosdis.nasa.gov/archive/allData/61/MOD11A1'
 DOWNLOAD_DIR = r'/home/slow_data/Air_Quality/MODIS'
 TOKEN = modis_config.TOKEN
@@ -99,9 +33,63 @@ START_DATE_STR = "2025-11-07"
 print(f"📅 Using date: {START_DATE_STR}")
 
 TILES = ["h27v06", "h28v06", "h27v07", "h28v07", "h28v08"]
+PRODUCT = 'MOD11A1'
+CATALOG_SOURCE = 'modis'  # Downloaded tiles are recorded in the shared file catalog
 
 CHECK_INTERVAL = 24 * 60 * 60  # 24 hours in seconds
-DOWNLOAD_SLEEP_SEC = 0.5
+
+# All LAADS requests share one keep-alive session; instead of a fixed sleep between files,
+# request starts are limited by a token bucket (REQUESTS_PER_SECOND, bursts of REQUEST_BURST).
+MAX_CONCURRENT_DOWNLOADS = 6
+REQUESTS_PER_SECOND = 4
+REQUEST_BURST = 8
+DAYS_IN_FLIGHT = 4  # days listed and downloaded at the same time during backfill
+
+# Cached availability index per year (see sync_range)
+INDEX_DIR = os.path.join(DOWNLOAD_DIR, 'index')
+INDEX_SETTLE_DAYS = 7  # LAADS may still add tiles to a day for about a week
+
+# Convert new tiles to station LST (process_modis_lst.py) after each sync
+PROCESS_AFTER_DOWNLOAD = True
+
+_day_executor = ThreadPoolExecutor(max_workers=DAYS_IN_FLIGHT, thread_name_prefix="modis-day")
+_index_lock = threading.Lock()
+_engine = None
+_catalog = None
+
+def get_engine():
+    """
+    Return the shared Earthdata client, creating it on first use. Without a configured
+    MODIS TOKEN, a bearer token is fetched once from URS with the Earthdata credentials
+    and cached on disk (ValueError if neither is configured).
+    """
+    global _engine
+    if _engine is None:
+        _engine = earthdata.get_client(
+            "laads",
+            token=TOKEN or None,
+            use_token=True,
+            max_connections=MAX_CONCURRENT_DOWNLOADS,
+            rate=REQUESTS_PER_SECOND,
+            burst=REQUEST_BURST,
+            headers={'user-agent': USERAGENT},
+        )
+    return _engine
+
+def get_catalog():
+    """Return the shared file catalog, opening its database on first use"""
+    global _catalog
+    if _catalog is None:
+        _catalog = File_catalog()
+    return _catalog
+
+def geturl(url):
+    """Return the content of the specified URL, or None on error"""
+    try:
+        return get_engine().get_text(url)
+    except requests.RequestException as e:
+        print(f'HTTP GET error: {e}', file=sys.stderr)
+        return None
 
 def make_url(date_obj):
     """Build the URL for a specific date folder."""
@@ -109,19 +97,19 @@ def make_url(date_obj):
     day_of_year = date_obj.strftime("%j")  # 001–366
     return f"{SERVER}/{year}/{day_of_year}"
 
-def list_files(url, token):
+def list_files(url):
     """
     Get the list of .hdf files at the given URL using NASA's method.
-    Returns list of file dictionaries with 'name' and 'size'.
+    Returns list of file dictionaries with 'name' and 'size', or None if the listing failed.
     """
     print(f"🔎 Listing files from {url}")
     
     try:
         import csv
-        content = geturl(f'{url}.csv', token)
+        content = geturl(f'{url}.csv')
         if content is None:
             print(f"❌ Failed to retrieve file list from {url}")
-            return []
+            return None
         
         files = []
         for f in csv.DictReader(StringIO(content), skipinitialspace=True):
@@ -131,10 +119,10 @@ def list_files(url, token):
     except ImportError:
         # Fallback to JSON if csv module not available
         import json
-        content = geturl(f'{url}.json', token)
+        content = geturl(f'{url}.json')
         if content is None:
             print(f"❌ Failed to retrieve file list from {url}")
-            return []
+            return None
         
         data = json.loads(content)
         return data.get('content', [])
@@ -149,25 +137,66 @@ def filter_tiles(files):
             filtered.append(f)
     return filtered
 
+def listed_size(f):
+    """File size from the LAADS listing, or None if it is not given"""
+    size = str(f.get('size', '')).strip()
+    return int(size) if size.isdigit() else None
+
+def listed_md5(f):
+    """MD5 checksum from the LAADS listing, or None if it is not given"""
+    return f.get('md5sum') or f.get('md5') or f.get('checksum') or None
+
+def modis_obs_time(name):
+    """Observation date of a tile, e.g. MOD11A1.A2025311.h27v06.061.*.hdf -> 2025-11-07"""
+    try:
+        return datetime.strptime(name.split('.')[1], "A%Y%j")
+    except (IndexError, ValueError):
+        return None
+
+def complete_files(files):
+    """
+    Names of the given listed files that the catalog holds at the listed size
+    (any size if the listing has none): one indexed query, no access to DOWNLOAD_DIR.
+    """
+    sizes = get_catalog().sizes(CATALOG_SOURCE, [f['name'] for f in files])
+    complete = set()
+    for f in files:
+        size = sizes.get(f['name'])
+        if size is not None and (listed_size(f) is None or size == listed_size(f)):
+            complete.add(f['name'])
+    return complete
+
+def fetch_tile(url, path, f):
+    """
+    Download one tile over the shared session (runs on the engine's transfer threads).
+    The tile is written to a .part file, resumed with Range requests after an interruption,
+    verified against the listed size and checksum, and only then renamed to `path`.
+    """
+    print(f'  Downloading: {os.path.basename(path)}')
+    size = get_engine().download(url, path, expected_size=listed_size(f), md5=listed_md5(f))
+    # Verified listed md5, or hashed from the just-written (still cached) file
+    checksum = (listed_md5(f) or file_md5(path)).lower()
+    get_catalog().record(CATALOG_SOURCE, f['name'], path, size, modis_obs_time(f['name']),
+                         product=PRODUCT, checksum=checksum)
+    return size
+
 def download_files(files, date_obj, base_url):
-    """Download the given list of files, skipping files that already exist."""
+    """Download the given list of files, skipping files that are already complete."""
     if not files:
         print(f"ℹ️ No matching tiles found for {date_obj.strftime('%Y-%m-%d')}")
         raise FileNotFoundError("No matching tiles found")
     
-    year = date_obj.strftime("%Y")
-    day = date_obj.strftime("%j")
-    local_path = os.path.join(DOWNLOAD_DIR, year, day)
+    local_path = day_dir(date_obj)
     os.makedirs(local_path, exist_ok=True)
 
     print(f"🔍 Checking {len(files)} files for {local_path}")
     files_to_download = []
+    complete = complete_files(files)
     
     for f in files:
         filename = f['name']
-        local_file = os.path.join(local_path, filename)
         
-        if os.path.exists(local_file) and os.path.getsize(local_file) > 0:
+        if filename in complete:
             print(f"✓ Skipping existing file: {filename}")
         else:
             files_to_download.append(f)
@@ -178,61 +207,139 @@ def download_files(files, date_obj, base_url):
 
     print(f"⬇️ Downloading {len(files_to_download)} new files to {local_path}")
 
+    futures = {}
     for f in files_to_download:
         filename = f['name']
-        url = f"{base_url}/{filename}"
-        path = os.path.join(local_path, filename)
-        
+        futures[filename] = get_engine().submit(fetch_tile, f"{base_url}/{filename}", os.path.join(local_path, filename), f)
+
+    for filename, future in futures.items():
         try:
-            print(f'  Downloading: {filename}')
-            with open(path, 'w+b') as fh:
-                geturl(url, TOKEN, fh)
+            future.result()
             print(f'  ✓ Downloaded: {filename}')
-        except IOError as e:
-            print(f"  ❌ Failed to download {filename}: {e.strerror}", file=sys.stderr)
-        
-        time.sleep(DOWNLOAD_SLEEP_SEC)
+        except (IOError, requests.RequestException) as e:
+            print(f"  ❌ Failed to download {filename}: {e}", file=sys.stderr)
 
     print(f"✅ Finished downloads for {date_obj.strftime('%Y-%m-%d')}\n")
 
-def download_for_date(date_obj):
-    """Download all matching tiles for a specific date."""
-    url = make_url(date_obj)
-    
-    try:
-        all_files = list_files(url, TOKEN)
-        wanted_files = filter_tiles(all_files)
-        download_files(wanted_files, date_obj, url)
-    except FileNotFoundError:
-        raise FileNotFoundError("No matching tiles found for this date")
-    
-    except Exception as e:
-        print(f"❌ Error processing {date_obj.strftime('%Y-%m-%d')}: {e}", file=sys.stderr)
+def day_dir(date_obj):
+    return os.path.join(DOWNLOAD_DIR, date_obj.strftime("%Y"), date_obj.strftime("%j"))
 
-def check_for_updates(last_date):
-    """Periodically check for new data since last known date."""
-    
-    # Ensure last_date is only the date component for comparison
-    last_checked_date = last_date.replace(hour=0, minute=0, second=0, microsecond=0)
-    
+################################################################################
+# Availability index: one listing of {SERVER}/{year} gives every published DOY;
+# the tile files of each DOY are cached after its first listing.
+################################################################################
+
+def index_path(year):
+    return os.path.join(INDEX_DIR, f"MOD11A1_{year}.json")
+
+def load_year_index(year):
+    """Cached index of a year: {'final', 'doys': [...], 'days': {doy: [tile file dicts]}}"""
+    path = index_path(year)
+    if os.path.exists(path):
+        with open(path) as fh:
+            return json.load(fh)
+    return {'final': False, 'doys': [], 'days': {}}
+
+def save_year_index(year, index):
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    path = index_path(year)
+    tmp_path = f"{path}.tmp"
+    with _index_lock, open(tmp_path, 'w') as fh:
+        json.dump(index, fh)
+    os.replace(tmp_path, path)
+
+def is_settled(end_time):
+    """True once LAADS is no longer expected to add files for a period ending at end_time"""
+    return datetime.now() - end_time >= timedelta(days=INDEX_SETTLE_DAYS)
+
+def refresh_year_index(year, index):
+    """List the year directory once to update the available DOYs (skipped for settled years)"""
+    if index['final']:
+        return index
+    entries = list_files(f"{SERVER}/{year}")
+    if entries:
+        index['doys'] = sorted(e['name'] for e in entries if e['name'].isdigit())
+        index['final'] = is_settled(datetime(year + 1, 1, 1))
+    return index
+
+def day_tiles(date_obj, index):
+    """
+    Tile files of one day, from the index when cached. A day is listed again only while
+    it is recent and still has fewer tiles than expected; a settled day is cached even
+    when none of its files match TILES.
+    """
+    doy = date_obj.strftime("%j")
+    settled = is_settled(date_obj + timedelta(days=1))
+    with _index_lock:
+        cached = index['days'].get(doy)
+    if cached is not None and (len(cached) >= len(TILES) or settled):
+        return cached
+
+    entries = list_files(make_url(date_obj))
+    if entries is None:
+        return cached or []
+    files = filter_tiles(entries)
+    if files or settled:
+        with _index_lock:
+            index['days'][doy] = files
+    return files or cached or []
+
+def sync_day(date_obj, index):
+    """Download the missing tiles of one available day. Returns 'complete', 'downloaded' or 'empty'."""
+    files = day_tiles(date_obj, index)
+    if not files:
+        print(f"ℹ️ No matching tiles found for {date_obj.strftime('%Y-%m-%d')}")
+        return 'empty'
+    if len(complete_files(files)) == len(files):
+        return 'complete'
+    download_files(files, date_obj, make_url(date_obj))
+    return 'downloaded'
+
+def sync_range(first_date, last_date):
+    """
+    Download every day in [first_date, last_date] that LAADS has published and that is not
+    complete locally, including gaps behind the newest day. Days are scheduled all at once
+    (DAYS_IN_FLIGHT listed concurrently); an unpublished day no longer blocks later ones.
+    """
+    indexes = {year: refresh_year_index(year, load_year_index(year))
+               for year in range(first_date.year, last_date.year + 1)}
+    available = {year: set(index['doys']) for year, index in indexes.items()}
+
+    days, date = [], first_date
+    while date <= last_date:
+        if date.strftime("%j") in available[date.year]:
+            days.append(date)
+        date += timedelta(days=1)
+
+    futures = {d: _day_executor.submit(sync_day, d, indexes[d.year]) for d in days}
+    results = {}
+    for d, future in futures.items():
+        try:
+            results[d] = future.result()
+        except Exception as e:
+            print(f"❌ Error processing {d.strftime('%Y-%m-%d')}: {e}", file=sys.stderr)
+            results[d] = 'error'
+
+    for year, index in indexes.items():
+        save_year_index(year, index)
+
+    total_days = (last_date - first_date).days + 1
+    downloaded = sum(1 for r in results.values() if r == 'downloaded')
+    print(f"📊 {first_date.strftime('%Y-%m-%d')} → {last_date.strftime('%Y-%m-%d')}: "
+          f"{len(days)}/{total_days} days published, {downloaded} downloaded, "
+          f"{total_days - len(days)} not yet available")
+    return results
+
+def check_for_updates(start_date):
+    """Periodically download newly published days (and late gaps) since start_date."""
     while True:
         print(f"\n⏰ Scheduled check at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        
+
         current_date_eod = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        check_date = last_checked_date + timedelta(days=1)
-        
-        dates_downloaded = 0
-        while check_date <= current_date_eod:
-            try:
-                download_for_date(check_date)
-            except FileNotFoundError:
-                print(f"🚫 No data found for {check_date.strftime('%Y-%m-%d')}. Stopping checks for now.")
-                break
-            last_checked_date = check_date
-            check_date += timedelta(days=1)
-            dates_downloaded += 1
-            
-        print(f"✅ Up to date through {last_checked_date.strftime('%Y-%m-%d')}")
+        sync_range(start_date, current_date_eod)
+        if PROCESS_AFTER_DOWNLOAD:
+            process_modis_lst.process_range(start_date, current_date_eod)
+
         print(f"🕒 Sleeping for {CHECK_INTERVAL / 3600} hours before next check...\n")
         time.sleep(CHECK_INTERVAL)
 
@@ -240,23 +347,26 @@ def main():
     start_date = datetime.strptime(START_DATE_STR, "%Y-%m-%d")
     current_date_eod = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
 
-    # First, download historical data and track the last date successfully checked
-    date = start_date
-    last_downloaded_date = start_date - timedelta(days=1)  # Initialize to day before start
-    
+    # Fail early (and clearly) if there is no token and no Earthdata login to fetch one
+    try:
+        get_engine()
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(1)
+
+    # Catalog the tiles downloaded before the catalog existed (first run only)
+    if get_catalog().count(CATALOG_SOURCE) == 0:
+        get_catalog().bootstrap(CATALOG_SOURCE, DOWNLOAD_DIR, modis_obs_time, product=PRODUCT, pattern='*.hdf')
+
+    # First, download all historical data that is already published
     print(f"📥 Starting historical download from {start_date.strftime('%Y-%m-%d')} to {current_date_eod.strftime('%Y-%m-%d')}")
-    
-    while date <= current_date_eod:
-        try:
-            download_for_date(date)
-        except FileNotFoundError:
-            break
-        last_downloaded_date = date  # Update the tracker
-        date += timedelta(days=1)
-    
-    # Then switch to update mode, starting from the last date processed
+    sync_range(start_date, current_date_eod)
+    if PROCESS_AFTER_DOWNLOAD:
+        process_modis_lst.process_range(start_date, current_date_eod)
+
+    # Then switch to update mode; each check only lists the current year and new days
     print(f"\n🔄 Switching to daily update mode...")
-    check_for_updates(last_downloaded_date)
+    check_for_updates(start_date)
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,230 @@
+import os
+import sys
+# Get the absolute path of the current script's directory
+current_script_dir = os.path.dirname(os.path.abspath(__file__))
+# Add the parent directory to sys.path (for util)
+sys.path.append(os.path.join(current_script_dir, os.pardir))
+import glob
+import hashlib
+import multiprocessing
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import rasterio
+
+from util.stations import get_stations
+
+################################################################################
+# MOD11A1 -> station LST
+#
+# Each day folder DOWNLOAD_DIR/{year}/{doy} holds up to five 1 km sinusoidal tiles.
+# The LST_Day/LST_Night and QC layers of the tiles are placed on one mosaic grid
+# (h27-h28 x v06-v08) and sampled at the stations with a cached pixel lookup.
+# Results are written as one small Parquet part per day:
+#
+#   STORE_DIR/year=2025/part-2025311.parquet
+################################################################################
+
+DOWNLOAD_DIR = r'/home/slow_data/Air_Quality/MODIS'
+STORE_DIR = r'/home/slow_data/Air_Quality/MODIS/station_lst'
+LOOKUP_CACHE_DIR = r'/home/work1/projects/Air_Quality/MODIS data/lookup_cache'
+
+PROCESS_WORKERS = 4
+PROCESS_MAX_TASKS_PER_CHILD = 200
+
+# MODIS sinusoidal grid (MODLAND tile system)
+EARTH_RADIUS = 6371007.181
+TILE_SIZE_M = 1111950.5197665554
+TILE_PIXELS = 1200  # 1 km products
+PIXEL_SIZE_M = TILE_SIZE_M / TILE_PIXELS
+GRID_X_MIN = -18 * TILE_SIZE_M
+GRID_Y_MAX = 9 * TILE_SIZE_M
+
+# Mosaic covering the Vietnam tiles downloaded by collect_data.py
+H_RANGE = (27, 28)
+V_RANGE = (6, 8)
+MOSAIC_SHAPE = ((V_RANGE[1] - V_RANGE[0] + 1) * TILE_PIXELS, (H_RANGE[1] - H_RANGE[0] + 1) * TILE_PIXELS)
+
+LST_GRID = 'MODIS_Grid_Daily_1km_LST'
+LAYERS = {
+    'lst_day': 'LST_Day_1km',
+    'qc_day': 'QC_Day',
+    'lst_night': 'LST_Night_1km',
+    'qc_night': 'QC_Night',
+}
+LST_SCALE = 0.02  # Kelvin per count; 0 is the fill value
+QC_FILL = 255
+
+_lookup_cache = {}
+
+
+def sinusoidal_pixels(lons, lats):
+    """Global row/col of lon/lat points on the 1 km MODIS sinusoidal grid"""
+    lon = np.radians(np.asarray(lons, dtype="float64"))
+    lat = np.radians(np.asarray(lats, dtype="float64"))
+    x = EARTH_RADIUS * lon * np.cos(lat)
+    y = EARTH_RADIUS * lat
+    cols = np.floor((x - GRID_X_MIN) / PIXEL_SIZE_M).astype("int64")
+    rows = np.floor((GRID_Y_MAX - y) / PIXEL_SIZE_M).astype("int64")
+    return rows, cols
+
+
+def station_mosaic_indices(lons, lats):
+    """
+    Row/col of every station on the mosaic grid, computed once per station set and
+    cached in memory and in LOOKUP_CACHE_DIR.
+
+    Returns:
+        tuple: (rows, cols, inside) arrays; `inside` is False for stations outside the mosaic.
+    """
+    lons = np.asarray(lons, dtype="float64")
+    lats = np.asarray(lats, dtype="float64")
+    key_src = lons.tobytes() + lats.tobytes() + repr((H_RANGE, V_RANGE, TILE_PIXELS)).encode()
+    key = hashlib.sha1(key_src).hexdigest()[:16]
+
+    if key not in _lookup_cache:
+        cache_file = os.path.join(LOOKUP_CACHE_DIR, f"mod11a1_{key}.npz")
+        if os.path.exists(cache_file):
+            with np.load(cache_file) as cached:
+                _lookup_cache[key] = (cached["rows"], cached["cols"], cached["inside"])
+        else:
+            rows, cols = sinusoidal_pixels(lons, lats)
+            rows -= V_RANGE[0] * TILE_PIXELS
+            cols -= H_RANGE[0] * TILE_PIXELS
+            inside = (rows >= 0) & (rows < MOSAIC_SHAPE[0]) & (cols >= 0) & (cols < MOSAIC_SHAPE[1])
+
+            os.makedirs(LOOKUP_CACHE_DIR, exist_ok=True)
+            tmp_file = cache_file + f".{os.getpid()}.tmp"
+            with open(tmp_file, "wb") as f:
+                np.savez(f, rows=rows, cols=cols, inside=inside)
+            os.replace(tmp_file, cache_file)
+            _lookup_cache[key] = (rows, cols, inside)
+    return _lookup_cache[key]
+
+
+def tile_position(hdf_file):
+    """(h, v) of a tile from its file name, e.g. MOD11A1.A2025311.h27v06.061.*.hdf"""
+    tile = os.path.basename(hdf_file).split('.')[2]
+    return int(tile[1:3]), int(tile[4:6])
+
+
+def read_layer(hdf_file, layer):
+    subdataset = f'HDF4_EOS:EOS_GRID:"{hdf_file}":{LST_GRID}:{LAYERS[layer]}'
+    with rasterio.open(subdataset) as src:
+        return src.read(1)
+
+
+def read_mosaic(hdf_files):
+    """
+    Mosaic of the LST and QC layers of one day.
+
+    Returns:
+        dict: layer -> array of MOSAIC_SHAPE; LST in Kelvin (NaN where missing), QC as uint8
+        (QC_FILL where no tile).
+    """
+    mosaic = {layer: np.full(MOSAIC_SHAPE, np.nan, dtype="float32") if layer.startswith('lst')
+              else np.full(MOSAIC_SHAPE, QC_FILL, dtype="uint8") for layer in LAYERS}
+
+    for hdf_file in hdf_files:
+        h, v = tile_position(hdf_file)
+        if not (H_RANGE[0] <= h <= H_RANGE[1] and V_RANGE[0] <= v <= V_RANGE[1]):
+            continue
+        r0 = (v - V_RANGE[0]) * TILE_PIXELS
+        c0 = (h - H_RANGE[0]) * TILE_PIXELS
+        for layer in LAYERS:
+            data = read_layer(hdf_file, layer)
+            if layer.startswith('lst'):
+                data = np.where(data == 0, np.nan, data * LST_SCALE).astype("float32")
+            mosaic[layer][r0:r0 + TILE_PIXELS, c0:c0 + TILE_PIXELS] = data
+    return mosaic
+
+
+def day_output_file(date_obj, store_dir=STORE_DIR):
+    return os.path.join(store_dir, f"year={date_obj.strftime('%Y')}", f"part-{date_obj.strftime('%Y%j')}.parquet")
+
+
+def process_day(day_dir, stations=None, store_dir=STORE_DIR):
+    """Extract station LST/QC from the tiles of one day folder ({year}/{doy}) and write the day's part file"""
+    if stations is None:
+        stations = get_stations()
+    hdf_files = sorted(glob.glob(os.path.join(day_dir, '*.hdf')))
+    if not hdf_files:
+        return None
+
+    year, doy = os.path.normpath(day_dir).split(os.sep)[-2:]
+    date_obj = datetime.strptime(f"{year}{doy}", "%Y%j")
+
+    rows, cols, inside = station_mosaic_indices(stations["longitude"].values, stations["latitude"].values)
+    mosaic = read_mosaic(hdf_files)
+
+    df = pd.DataFrame({
+        "station_id": stations["station_id"].values.astype("int64"),
+        "date": pd.Series([date_obj] * len(stations), dtype="datetime64[ns]"),
+    })
+    for layer, grid in mosaic.items():
+        values = np.full(len(stations), np.nan if layer.startswith('lst') else QC_FILL, dtype=grid.dtype)
+        values[inside] = grid[rows[inside], cols[inside]]
+        df[layer] = values
+
+    output_file = day_output_file(date_obj, store_dir)
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    tmp_file = f"{output_file}.{os.getpid()}.tmp"
+    df.to_parquet(tmp_file, index=False)
+    os.replace(tmp_file, output_file)
+    return output_file
+
+
+def pending_days(first_date, last_date, download_dir=DOWNLOAD_DIR, store_dir=STORE_DIR):
+    """Day folders with tiles whose output is missing or older than the newest tile"""
+    days = []
+    date = first_date
+    while date <= last_date:
+        day_dir = os.path.join(download_dir, date.strftime("%Y"), date.strftime("%j"))
+        hdf_files = glob.glob(os.path.join(day_dir, '*.hdf'))
+        if hdf_files:
+            output_file = day_output_file(date, store_dir)
+            newest_tile = max(os.path.getmtime(f) for f in hdf_files)
+            if not os.path.exists(output_file) or os.path.getmtime(output_file) < newest_tile:
+                days.append(day_dir)
+        date += timedelta(days=1)
+    return days
+
+
+def _process_day_task(day_dir):
+    try:
+        return day_dir, process_day(day_dir), None
+    except Exception as e:
+        return day_dir, None, str(e)
+
+
+def process_days(day_dirs, workers=PROCESS_WORKERS):
+    """Convert many day folders in a process pool; returns the number of days written"""
+    if not day_dirs:
+        return 0
+
+    written = 0
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(processes=min(workers, len(day_dirs)), maxtasksperchild=PROCESS_MAX_TASKS_PER_CHILD) as pool:
+        for day_dir, output_file, error in pool.imap_unordered(_process_day_task, day_dirs):
+            if error is not None:
+                print(f"❌ Failed to process {day_dir}: {error}", file=sys.stderr)
+            elif output_file is not None:
+                written += 1
+    print(f"🌡️ Processed {written}/{len(day_dirs)} MOD11A1 days")
+    return written
+
+
+def process_range(first_date, last_date, workers=PROCESS_WORKERS):
+    """Process every downloaded day in [first_date, last_date] that has no up-to-date output"""
+    return process_days(pending_days(first_date, last_date), workers)
+
+
+if __name__ == "__main__":
+    # python process_modis_lst.py YYYY-MM-DD [YYYY-MM-DD]
+    if len(sys.argv) < 2:
+        print("Usage: process_modis_lst.py START_DATE [END_DATE]")
+        sys.exit(1)
+    start = datetime.strptime(sys.argv[1], "%Y-%m-%d")
+    end = datetime.strptime(sys.argv[2], "%Y-%m-%d") if len(sys.argv) > 2 else datetime.now()
+    process_range(start, end)
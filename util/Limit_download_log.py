@@ -1,52 +1,392 @@
 from collections import OrderedDict
 import os
+import time
+import atexit
+import hashlib
+import weakref
+import threading
+
+import numpy as np
+
+FLUSH_TICK = 0.25  # Seconds between checks of the background flusher
+
+# Open logs, flushed by one background thread and closed at exit. Weak references: a log
+# that is no longer used elsewhere can still be garbage collected.
+_open_logs = weakref.WeakSet()
+_open_logs_lock = threading.Lock()
+_flusher = None
+
+
+def _register_log(log):
+    global _flusher
+    with _open_logs_lock:
+        _open_logs.add(log)
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, daemon=True, name="download-log-flush")
+            _flusher.start()
+
+
+def _open_logs_snapshot():
+    with _open_logs_lock:
+        return list(_open_logs)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_TICK)
+        for log in _open_logs_snapshot():
+            log._flush_if_due()
+
+
+@atexit.register
+def _close_all_logs():
+    for log in _open_logs_snapshot():
+        log.close()
+
+
+def item_hash(item):
+    """64-bit hash of an item (stable across runs, unlike hash())"""
+    return int.from_bytes(hashlib.blake2b(item.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class Hash_set:
+    """
+    Set of fixed-width item hashes: a sorted numpy array searched with binary search,
+    plus a preallocated sorted staging array of STAGING_SIZE recent additions that is
+    merged into it in place when full. Memory is `hash_bytes` per item (the main array
+    grows by GROWTH with realloc) plus the staging array; nbytes() reports both.
+
+    hash_bytes=8: ~n / 2**64 false positives per lookup (negligible).
+    hash_bytes=4: ~n / 2**32, i.e. ~0.2% at 10M items and ~0.5% at 20M. A false positive
+    reports an item that was never added as present, so a download log in this mode
+    silently skips that fraction of new files. Only use it where that is acceptable.
+    """
+
+    STAGING_SIZE = 8192
+    GROWTH = 1.25
+
+    def __init__(self, hash_bytes=8):
+        if hash_bytes not in (4, 8):
+            raise ValueError("hash_bytes must be 4 or 8")
+        self.dtype = np.dtype(f"<u{hash_bytes}")
+        self.mask = (1 << (8 * hash_bytes)) - 1
+        self._sorted = np.empty(0, dtype=self.dtype)  # Capacity; only the first _size entries are used
+        self._size = 0
+        self._staging = np.empty(self.STAGING_SIZE, dtype=self.dtype)
+        self._staged = 0  # Used length of _staging
+
+    def add(self, h):
+        """Add a 64-bit item hash; returns False if it was already present"""
+        h = self.dtype.type(h & self.mask)
+        if self._contains(self._sorted[:self._size], h):
+            return False
+        i = np.searchsorted(self._staging[:self._staged], h)
+        if i < self._staged and self._staging[i] == h:
+            return False
+        # Keep the staging array sorted: shift the tail by one (in place, no allocation)
+        self._staging[i + 1:self._staged + 1] = self._staging[i:self._staged]
+        self._staging[i] = h
+        self._staged += 1
+        if self._staged == self.STAGING_SIZE:
+            self._merge()
+        return True
+
+    @staticmethod
+    def _contains(values, h):
+        i = np.searchsorted(values, h)
+        return i < len(values) and values[i] == h
+
+    def __contains__(self, h):
+        h = self.dtype.type(h & self.mask)
+        return self._contains(self._sorted[:self._size], h) or self._contains(self._staging[:self._staged], h)
+
+    def _merge(self):
+        """Merge the staging array into the main array in place, from the back"""
+        k, n = self._staged, self._size
+        if not k:
+            return
+        if n + k > len(self._sorted):
+            # realloc (mremap for large arrays) instead of allocating a second array
+            self._sorted.resize(max(n + k, int(len(self._sorted) * self.GROWTH)), refcheck=False)
+        values, staged = self._sorted, self._staging[:k]
+        positions = np.searchsorted(values[:n], staged)
+        end = n
+        for j in range(k - 1, -1, -1):
+            p = positions[j]
+            values[p + j + 1:end + j + 1] = values[p:end]
+            values[p + j] = staged[j]
+            end = p
+        self._size = n + k
+        self._staged = 0
+
+    def to_array(self):
+        """Sorted array of all hashes (a copy, safe to write out while adding continues)"""
+        self._merge()
+        return self._sorted[:self._size].copy()
+
+    def load(self, hashes):
+        self._sorted = np.unique(np.asarray(hashes).astype(self.dtype)).copy()  # Owns its data (resizable)
+        self._size = len(self._sorted)
+        self._staged = 0
+
+    def nbytes(self):
+        return self._sorted.nbytes + self._staging.nbytes
+
+    def __len__(self):
+        return self._size + self._staged
+
+
+class Bloom_filter:
+    """Bloom filter on 64-bit item hashes; `bits_per_item` = 10 gives ~1% false positives at `capacity`"""
+
+    def __init__(self, capacity, bits_per_item=10):
+        self.size = max(64, int(capacity * bits_per_item))
+        self.k = max(1, round(bits_per_item * 0.693))
+        self.bits = bytearray((self.size + 7) // 8)  # bytearray: fast scalar access, numpy view for bulk adds
+
+    MIX = 0x9E3779B97F4A7C15  # Spreads 32-bit (masked) hashes over 64 bits before splitting them
+
+    def _positions(self, h):
+        m = (h * self.MIX) & 0xFFFFFFFFFFFFFFFF
+        h1, h2 = m & 0xFFFFFFFF, (m >> 32) | 1
+        return [(h1 + i * h2) % self.size for i in range(self.k)]
+
+    def add(self, h):
+        for p in self._positions(h):
+            self.bits[p >> 3] |= 1 << (p & 7)
+
+    def add_many(self, hashes):
+        """Vectorized add of an array of 64-bit hashes"""
+        m = np.asarray(hashes, dtype=np.uint64) * np.uint64(self.MIX)  # wraps modulo 2**64
+        h1 = m & np.uint64(0xFFFFFFFF)
+        h2 = (m >> np.uint64(32)) | np.uint64(1)
+        bits = np.frombuffer(self.bits, dtype=np.uint8)
+        for i in range(self.k):
+            p = (h1 + np.uint64(i) * h2) % np.uint64(self.size)
+            np.bitwise_or.at(bits, (p >> np.uint64(3)).astype(np.int64),
+                             (np.uint8(1) << (p & np.uint64(7)).astype(np.uint8)))
+
+    def __contains__(self, h):
+        return all(self.bits[p >> 3] >> (p & 7) & 1 for p in self._positions(h))
+
 
 class Limit_download_log:
-    def __init__(self, max_size=5000, log_path=None, log_limit_lines=100000):
+    """
+    Set of the `max_size` most recently added items, optionally backed by a log file.
+
+    The log is kept open and buffered; a background thread flushes new lines within
+    `flush_interval` seconds (+ FLUSH_TICK), also when no more items are added.
+    Once more than `log_limit_lines` lines were appended, a background thread rewrites
+    it as a compact snapshot of the items in memory and swaps it in atomically, so
+    startup only reads that snapshot plus the lines appended since.
+
+    With `compact=True` the set keeps every item ever added (max_size is ignored) as a
+    fixed-width hash (`hash_bytes` per item, see Hash_set) instead of the full string,
+    optionally behind a Bloom filter (`bloom_bits_per_item`, sized for `expected_items`)
+    so most lookups of new items never touch the hash array. The snapshot is then
+    `log_path.snapshot.npz` and the text log only holds items added since.
+
+    WARNING: keep hash_bytes=8 for download logs. With hash_bytes=4 about n / 2**32 of
+    the new items (~0.5% at 20M entries) collide with a stored hash and are reported as
+    already downloaded, so those files are silently never fetched.
+    """
+
+    def __init__(self, max_size=5000, log_path=None, log_limit_lines=100000, flush_interval=1.0,
+                 compact=False, hash_bytes=8, bloom_bits_per_item=None, expected_items=10_000_000):
         self.max_size = max_size
         self.data = OrderedDict()
         self.log_path = log_path
-        self.log_limit_lines = log_limit_lines
+        self.log_limit_lines = log_limit_lines if compact else max(log_limit_lines, max_size)
+        self.flush_interval = flush_interval
 
-        # Load existing recent items if needed (optional)
-        if self.log_path and os.path.exists(self.log_path):
-            with open(self.log_path, "r") as f:
-                for line in f:
-                    item = line.strip()
-                    if item:
-                        self.add(item, log=False)
+        self.compact = compact
+        self.hashes = Hash_set(hash_bytes) if compact else None
+        self.bloom = Bloom_filter(expected_items, bloom_bits_per_item) if compact and bloom_bits_per_item else None
 
-    #TODO: fix add method
-    def add(self, item, log=True):
-        if item in self.data:
-            return  # already seen
-        
-        # remove oldest if over limit
-        if len(self.data) >= self.max_size:
+        self._lock = threading.RLock()
+        self._log = None
+        self._log_lines = 0
+        self._last_flush = time.monotonic()
+        self._dirty = False  # Lines written since the last flush
+        self._compaction = None  # background thread while compacting
+        self._tail = None  # items logged while a compaction is running
+
+        if self.log_path:
+            self._load_snapshot()
+            self._log = open(self.log_path, "a", buffering=1024 * 1024)
+            _register_log(self)
+
+    @property
+    def snapshot_path(self):
+        return f"{self.log_path}.snapshot.npz"
+
+    def _load_snapshot(self):
+        """Load the snapshot and the items appended to the log after it"""
+        if self.compact and os.path.exists(self.snapshot_path):
+            with np.load(self.snapshot_path) as snapshot:
+                if snapshot["hashes"].dtype.itemsize != self.hashes.dtype.itemsize:
+                    raise ValueError(f"{self.snapshot_path} holds {snapshot['hashes'].dtype.itemsize}-byte hashes, "
+                                     f"not hash_bytes={self.hashes.dtype.itemsize}")
+                self.hashes.load(snapshot["hashes"])
+                bloom_ok = (self.bloom is not None and "bloom" in snapshot
+                            and snapshot["bloom"].size == len(self.bloom.bits) and int(snapshot["bloom_k"]) == self.bloom.k)
+                if bloom_ok:
+                    self.bloom.bits = bytearray(snapshot["bloom"].tobytes())
+            if self.bloom is not None and not bloom_ok:
+                self.bloom.add_many(self.hashes.to_array())
+
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, "r") as f:
+            lines = [line for line in f.read().splitlines() if line]
+        self._log_lines = len(lines)
+        if self.compact:
+            for item in lines:
+                self._add_hash(item_hash(item))
+            return
+        # Later duplicates move to the end, like add() does
+        for item in lines:
+            self.data.pop(item, None)
+            self.data[item] = None
+        while len(self.data) > self.max_size:
             self.data.popitem(last=False)
-        self.data[item] = None
-        
-        # write to log file
-        if log and self.log_path:
-            with open(self.log_path, "a") as f:
-                f.write(item + "\n")
-            self._trim_log_if_needed()
-
-    def _trim_log_if_needed(self):
-        """Keep only the last `log_limit_lines` lines in log."""
-        if not self.log_path:
+
+    def _add_hash(self, h):
+        h &= self.hashes.mask  # The Bloom filter sees the same (stored) hash as the array
+        if not self.hashes.add(h):
+            return False
+        if self.bloom is not None:
+            self.bloom.add(h)
+        return True
+
+    def add(self, item, log=True):
+        item = item.strip()  # The log is line based; keep memory and reloads consistent
+        if not item:
             return
-        size = os.path.getsize(self.log_path)
-        if size > 10 * 1024 * 1024:  # ~10 MB safety check
-            with open(self.log_path, "r+") as f:
-                lines = f.readlines()
-                if len(lines) > self.log_limit_lines:
-                    f.seek(0)
-                    f.writelines(lines[-self.log_limit_lines:])
-                    f.truncate()
+        with self._lock:
+            if self.compact:
+                if not self._add_hash(item_hash(item)):
+                    return
+            elif item in self.data:
+                self.data.move_to_end(item)  # Seen again: keep it as recent, do not log twice
+                return
+            else:
+                # remove oldest if over limit
+                if len(self.data) >= self.max_size:
+                    self.data.popitem(last=False)
+                self.data[item] = None
+
+            # write to log file
+            if log and self._log is not None:
+                self._log.write(item + "\n")
+                self._log_lines += 1
+                self._dirty = True
+                if self._tail is not None:
+                    self._tail.append(item)
+                now = time.monotonic()
+                if now - self._last_flush >= self.flush_interval:
+                    self.flush()
+                if self._log_lines > self.log_limit_lines and self._compaction is None:
+                    self._start_compaction()
+
+    def _take_snapshot(self):
+        """Copy of the current content for _compact (called with the lock held)"""
+        self._tail = []
+        if self.compact:
+            return self.hashes.to_array(), None if self.bloom is None else np.frombuffer(bytes(self.bloom.bits), dtype=np.uint8)
+        return list(self.data)
+
+    def _start_compaction(self):
+        snapshot = self._take_snapshot()
+        self._compaction = threading.Thread(target=self._compact, args=(snapshot,), daemon=True,
+                                            name="download-log-compaction")
+        self._compaction.start()
+
+    def _compact(self, snapshot):
+        """Write `snapshot` to a temp file, append what was logged meanwhile, and swap it in"""
+        tmp_path = f"{self.log_path}.compact.tmp"
+        try:
+            if self.compact:
+                hashes, bloom = snapshot
+                tmp_snapshot = f"{self.snapshot_path}.tmp"
+                with open(tmp_snapshot, "wb") as f:
+                    extra = {} if bloom is None else {"bloom": bloom, "bloom_k": np.array(self.bloom.k)}
+                    np.savez(f, hashes=hashes, **extra)
+                    f.flush()
+                    os.fsync(f.fileno())
+                snapshot = []  # The text log only keeps what was added after the snapshot
+
+            with open(tmp_path, "w") as f:
+                f.write("".join(item + "\n" for item in snapshot))
+                with self._lock:
+                    tail, self._tail = self._tail, None
+                    f.write("".join(item + "\n" for item in tail))
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self._log.close()
+                    if self.compact:
+                        os.replace(tmp_snapshot, self.snapshot_path)
+                    os.replace(tmp_path, self.log_path)
+                    self._log = open(self.log_path, "a", buffering=1024 * 1024)
+                    self._log_lines = len(snapshot) + len(tail)
+        except OSError as e:
+            print(f"⚠️ Could not compact {self.log_path}: {e}")
+            with self._lock:
+                self._tail = None
+                if self._log is None or self._log.closed:
+                    self._log = open(self.log_path, "a", buffering=1024 * 1024)
+        finally:
+            with self._lock:
+                self._compaction = None
+
+    def flush(self):
+        with self._lock:
+            if self._log is not None and not self._log.closed:
+                self._log.flush()
+                self._last_flush = time.monotonic()
+                self._dirty = False
+
+    def _flush_if_due(self):
+        """Called by the background flusher"""
+        with self._lock:
+            if self._dirty and time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+    def close(self):
+        """Wait for a running compaction, compact if the log is over its limit, and close the log"""
+        with _open_logs_lock:
+            _open_logs.discard(self)
+        compaction = self._compaction
+        if compaction is not None:
+            compaction.join()
+        if self._log is not None and not self._log.closed and self._log_lines > self.log_limit_lines:
+            with self._lock:
+                snapshot = self._take_snapshot()
+            self._compact(snapshot)
+        with self._lock:
+            if self._log is not None and not self._log.closed:
+                self._log.close()
 
     def __contains__(self, item):
-        return item in self.data
+        item = item.strip()
+        if not self.compact:
+            return item in self.data
+        h = item_hash(item) & self.hashes.mask
+        if self.bloom is not None and h not in self.bloom:
+            return False
+        with self._lock:
+            return h in self.hashes
+
+    def __len__(self):
+        return len(self.hashes) if self.compact else len(self.data)
+
+    def memory_bytes(self):
+        """Memory of the compact structures: hash array, staging array and Bloom filter"""
+        if not self.compact:
+            return None
+        return self.hashes.nbytes() + (0 if self.bloom is None else len(self.bloom.bits))
 
     def __repr__(self):
+        if self.compact:
+            return f"LimitedSet(size={len(self)}, compact, {self.memory_bytes() / 2**20:.1f} MiB)"
         return f"LimitedSet(size={len(self.data)}, max={self.max_size})"
@@ -0,0 +1,134 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from util.file_catalog import file_md5
+
+
+class Token_bucket:
+    """Thread-safe token bucket: `rate` requests per second on average, bursts of up to `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Block until `tokens` are available, then take them"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Download_engine:
+    """
+    Concurrent HTTP(S) downloads over one pooled keep-alive session.
+
+    Up to `max_connections` transfers run at once and reuse their TCP/TLS connections.
+    When `rate` is set, request starts are limited by a token bucket instead of a fixed sleep.
+    Transient errors (connection resets, 429 and 5xx) are retried with backoff.
+    A prepared `session` (e.g. with authentication) can be passed in; it gets the pooled adapters.
+    """
+
+    def __init__(self, max_connections=4, rate=None, burst=None, headers=None, timeout=120, retries=3, session=None):
+        self.timeout = timeout
+        self.session = session if session is not None else requests.Session()
+        retry = Retry(total=retries, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=["GET", "HEAD"])
+        adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+        self.bucket = Token_bucket(rate, burst) if rate else None
+        self.executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="download")
+
+    def get(self, url, **kwargs):
+        """Rate-limited GET on the shared session"""
+        if self.bucket is not None:
+            self.bucket.acquire()
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def get_text(self, url):
+        response = self.get(url)
+        response.raise_for_status()
+        return response.text
+
+    def download(self, url, path, expected_size=None, md5=None, attempts=3, chunk_size=1024 * 1024):
+        """
+        Download `url` to `path` through a `path.part` temp file that is renamed into place
+        only when complete. An interrupted transfer is continued with an HTTP Range request,
+        also by a later call, so a restart never downloads the same bytes twice.
+
+        `expected_size` and `md5` (hex) are checked when given. A transfer that ends short is
+        continued with another Range request (up to `attempts`) and the .part file is kept if
+        it is still short; a file that is too long or fails the MD5 check is deleted. IOError
+        is raised on failure. Returns the final size in bytes.
+        """
+        part_path = f"{path}.part"
+        for attempt in range(1, attempts + 1):
+            try:
+                self._fetch_part(url, part_path, expected_size, chunk_size)
+                size = os.path.getsize(part_path)
+                if expected_size is not None and size < expected_size:
+                    # Connection closed early: the next attempt asks for the rest with Range
+                    raise IOError(f"short transfer ({size} of {expected_size} bytes)")
+                break
+            except (requests.RequestException, IOError) as e:
+                if attempt == attempts:
+                    raise
+                print(f"  ⚠️ {os.path.basename(path)}: {e}, resuming (attempt {attempt + 1}/{attempts})")
+
+        if expected_size is not None and size > expected_size:
+            os.remove(part_path)
+            raise IOError(f"size mismatch for {os.path.basename(path)}: {size} != {expected_size}")
+        if md5 and file_md5(part_path) != md5.lower():
+            os.remove(part_path)
+            raise IOError(f"md5 mismatch for {os.path.basename(path)}")
+
+        os.replace(part_path, path)
+        return size
+
+    def _fetch_part(self, url, part_path, expected_size, chunk_size):
+        """Fetch the rest of `url` into the partial file, starting after the bytes already there"""
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if expected_size is not None and offset >= expected_size:
+            return  # Complete (or too long, which the size check rejects)
+
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        with self.get(url, stream=True, headers=headers) as response:
+            if response.status_code == 416 and offset:
+                # Unsatisfiable range: the partial file is bad, start over
+                os.remove(part_path)
+                raise IOError("server rejected the resume range")
+            response.raise_for_status()
+
+            # 200 instead of 206: the server ignored the range, rewrite from the start
+            mode = "ab" if offset and response.status_code == 206 else "wb"
+            with open(part_path, mode) as fh:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    fh.write(chunk)
+
+    def submit(self, fn, *args, **kwargs):
+        """Run `fn` on the engine's transfer threads"""
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
@@ -0,0 +1,133 @@
+import os
+import json
+import threading
+from datetime import datetime, timedelta
+from http.cookiejar import MozillaCookieJar, LoadError
+from urllib.parse import urlparse
+
+import requests
+
+from config.config import earthdata_config
+from util.download_engine import Download_engine
+
+URS_HOST = "urs.earthdata.nasa.gov"
+URS_TOKEN_URL = f"https://{URS_HOST}/api/users/find_or_create_token"
+COOKIE_FILE = "/home/work1/.urs_cookies"
+TOKEN_CACHE_FILE = "/home/work1/.urs_token.json"
+TOKEN_REFRESH_BEFORE = timedelta(days=2)  # Replace a cached token this long before it expires
+
+_clients = {}
+_clients_lock = threading.Lock()
+_token_lock = threading.Lock()
+
+
+class URS_session(requests.Session):
+    """
+    requests session for Earthdata-protected servers (GES DISC, LAADS, ...).
+
+    Username/password are sent only to the URS login host during the data server ->
+    URS -> data server redirects; the resulting cookies are shared by every request
+    and persisted to `cookie_file`. A bearer `token` is sent to the data servers and
+    dropped on redirects to other hosts.
+    """
+
+    def __init__(self, username=None, password=None, token=None, cookie_file=None):
+        super().__init__()
+        self._credentials = (username, password) if username else None
+        self.token = token
+        if token:
+            self.headers["Authorization"] = f"Bearer {token}"
+        if cookie_file:
+            os.makedirs(os.path.dirname(cookie_file), exist_ok=True)
+            self.cookies = MozillaCookieJar(cookie_file)
+            try:
+                self.cookies.load(ignore_discard=True, ignore_expires=True)
+            except (FileNotFoundError, LoadError):
+                pass
+
+    def rebuild_auth(self, prepared_request, response):
+        original = urlparse(response.request.url).hostname
+        redirect = urlparse(prepared_request.url).hostname
+        if original == redirect:
+            return
+        prepared_request.headers.pop("Authorization", None)
+        if redirect == URS_HOST and self._credentials:
+            prepared_request.prepare_auth(self._credentials)
+
+    def save_cookies(self):
+        if isinstance(self.cookies, MozillaCookieJar):
+            self.cookies.save(ignore_discard=True, ignore_expires=True)
+
+
+def bearer_token(username=None, password=None, cache_file=TOKEN_CACHE_FILE):
+    """
+    Earthdata bearer token, cached on disk until shortly before it expires so the URS
+    token API is only called when a new token is needed. Raises ValueError when no
+    cached token is usable and the credentials are missing or rejected.
+    """
+    username = username or earthdata_config.EARTHDATA_USERNAME
+    password = password or earthdata_config.EARTHDATA_PASSWORD
+
+    with _token_lock:
+        if os.path.exists(cache_file):
+            with open(cache_file) as f:
+                cached = json.load(f)
+            expires = datetime.strptime(cached["expiration_date"], "%m/%d/%Y")
+            if cached.get("username") == username and expires - datetime.now() > TOKEN_REFRESH_BEFORE:
+                return cached["access_token"]
+
+        if not username or not password:
+            raise ValueError("No Earthdata token configured and no EARTHDATA_USERNAME/EARTHDATA_PASSWORD "
+                             "to fetch one: set the token or the credentials in the environment")
+        response = requests.post(URS_TOKEN_URL, auth=(username, password), timeout=60)
+        if response.status_code == 401:
+            raise ValueError(f"Earthdata rejected the credentials of {username} (HTTP 401)")
+        response.raise_for_status()
+        token = response.json()
+
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = f"{cache_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"username": username, "access_token": token["access_token"],
+                       "expiration_date": token["expiration_date"]}, f)
+        os.chmod(tmp_file, 0o600)
+        os.replace(tmp_file, cache_file)
+        return token["access_token"]
+
+
+def get_client(name, token=None, use_token=False, username=None, password=None, cookie_file=COOKIE_FILE,
+               **engine_kwargs):
+    """
+    Shared Download_engine on an authenticated URS_session, created once per process
+    and `name`. Later calls with the same name return the same client, so connections,
+    cookies and tokens are reused by every caller.
+
+    Parameters
+    ----------
+    token : str, optional
+        Bearer token to send; with `use_token=True` and no token, one is fetched (and cached)
+        from URS with the Earthdata credentials.
+    username, password : str, optional
+        Earthdata credentials for the URS redirect login (default: earthdata_config).
+    engine_kwargs
+        max_connections, rate, burst, headers, ... passed to Download_engine.
+    """
+    with _clients_lock:
+        if name not in _clients:
+            username = username or earthdata_config.EARTHDATA_USERNAME
+            password = password or earthdata_config.EARTHDATA_PASSWORD
+            if token is None and use_token:
+                token = bearer_token(username, password)
+            session = URS_session(username, password, token, cookie_file)
+            _clients[name] = Download_engine(session=session, **engine_kwargs)
+        return _clients[name]
+
+
+def close_clients():
+    """Persist cookies and close every shared client"""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.session.save_cookies()
+        client.close()
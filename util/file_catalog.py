@@ -0,0 +1,182 @@
+import os
+import time
+import hashlib
+import sqlite3
+import fnmatch
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Catalog of every file the collectors have on disk, so "do we already have it?" and
+# "what do we have for date X?" are indexed lookups instead of stat/listdir calls on
+# /home/slow_data. Each collector records the files it writes and bootstraps its
+# source once from the existing directories (see File_catalog.bootstrap).
+CATALOG_DB = "/home/work1/projects/Air_Quality/file_catalog.sqlite"
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+QUERY_CHUNK = 500  # Names per IN (...) query, below SQLite's parameter limit
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    source TEXT NOT NULL,          -- collector, e.g. modis, imerg_gis, himawari
+    name TEXT NOT NULL,            -- file name, unique within a source
+    product TEXT,
+    obs_time TEXT,                 -- observation time, YYYY-mm-dd HH:MM:SS
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    checksum TEXT,                 -- MD5 hex; NULL for files recorded by bootstrap()
+    recorded_at REAL NOT NULL,
+    PRIMARY KEY (source, name)
+);
+CREATE INDEX IF NOT EXISTS idx_files_obs_time ON files (source, obs_time);
+"""
+
+
+def file_md5(path, chunk_size=1024 * 1024):
+    digest = hashlib.md5()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class File_catalog:
+    """
+    SQLite catalog of downloaded files: source, product, observation time, path, size and
+    MD5 checksum. Collectors record the checksum of every file they write (computed while
+    streaming, or from the freshly written file); files found by bootstrap() have none.
+    """
+
+    def __init__(self, db_path=CATALOG_DB):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    # --- Writes ---
+    def record(self, source, name, path, size, obs_time=None, product=None, checksum=None):
+        """Add or replace one file"""
+        self.record_many(source, [(name, path, size, obs_time, checksum)], product)
+
+    def record_many(self, source, files, product=None):
+        """Add or replace many files of one source; `files` holds (name, path, size, obs_time, checksum) tuples"""
+        now = time.time()
+        rows = [(source, name, product, obs_time.strftime(TIME_FORMAT) if obs_time is not None else None,
+                 path, int(size), checksum, now) for name, path, size, obs_time, checksum in files]
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._db.commit()
+
+    def remove(self, source, name):
+        with self._lock:
+            self._db.execute("DELETE FROM files WHERE source = ? AND name = ?", (source, name))
+            self._db.commit()
+
+    # --- Queries ---
+    def count(self, source):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM files WHERE source = ?", (source,)).fetchone()[0]
+
+    def sizes(self, source, names):
+        """{name: recorded size} for the given names that are in the catalog (one query per QUERY_CHUNK names)"""
+        names = list(names)
+        found = {}
+        with self._lock:
+            for i in range(0, len(names), QUERY_CHUNK):
+                chunk = names[i:i + QUERY_CHUNK]
+                rows = self._db.execute(
+                    f"SELECT name, size FROM files WHERE source = ? AND name IN ({','.join('?' * len(chunk))})",
+                    [source, *chunk]).fetchall()
+                found.update(rows)
+        return found
+
+    def existing(self, source, names):
+        """Subset of `names` that are in the catalog"""
+        return set(self.sizes(source, names))
+
+    def files_between(self, source, start, end, product=None):
+        """[(name, path, size, checksum)] of files with start <= obs_time < end, oldest first"""
+        sql = "SELECT name, path, size, checksum FROM files WHERE source = ? AND obs_time >= ? AND obs_time < ?"
+        params = [source, start.strftime(TIME_FORMAT), end.strftime(TIME_FORMAT)]
+        if product is not None:
+            sql += " AND product = ?"
+            params.append(product)
+        with self._lock:
+            return self._db.execute(sql + " ORDER BY obs_time, name", params).fetchall()
+
+    # --- Bootstrap ---
+    def bootstrap(self, source, root, parse_obs_time=None, product=None, pattern="*", workers=8):
+        """
+        Record every file under `root` whose name matches `pattern`, crawling the directory
+        tree with `workers` threads (one subtree each). `parse_obs_time(name)` returns the
+        observation time of a file, or None. Checksums are not computed (hashing the whole
+        archive would cost far more than the crawl), so these rows have checksum NULL.
+
+        Returns:
+            int: number of files recorded.
+        """
+        if not os.path.isdir(root):
+            return 0
+        print(f"🗂️ Building the {source} file catalog from {root} ...")
+        started = time.time()
+
+        subtrees, files = _split_tree(root, workers * 4)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="catalog-crawl") as executor:
+            for found in executor.map(_scan_tree, subtrees):
+                files.extend(found)
+
+        rows = []
+        for name, path, size in files:
+            if fnmatch.fnmatch(name, pattern):
+                obs_time = parse_obs_time(name) if parse_obs_time is not None else None
+                rows.append((name, path, size, obs_time, None))
+        for i in range(0, len(rows), 10000):
+            self.record_many(source, rows[i:i + 10000], product)
+
+        print(f"🗂️ Catalogued {len(rows)} {source} files in {time.time() - started:.1f} s")
+        return len(rows)
+
+
+def _split_tree(root, min_subtrees):
+    """
+    Expand `root` breadth-first until there are at least `min_subtrees` directories to
+    crawl in parallel. Returns (directories, [(name, path, size)] of files seen on the way).
+    """
+    dirs, files = [root], []
+    for _ in range(3):
+        if len(dirs) >= min_subtrees:
+            break
+        next_dirs = []
+        for d in dirs:
+            try:
+                with os.scandir(d) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            next_dirs.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            files.append((entry.name, entry.path, entry.stat().st_size))
+            except OSError as e:
+                print(f"⚠️ Cannot list {d}: {e}")
+        if not next_dirs:
+            return [], files
+        dirs = next_dirs
+    return dirs, files
+
+
+def _scan_tree(top):
+    """[(name, path, size)] of every file below `top`"""
+    found, stack = [], [top]
+    while stack:
+        d = stack.pop()
+        try:
+            with os.scandir(d) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        found.append((entry.name, entry.path, entry.stat().st_size))
+        except OSError as e:
+            print(f"⚠️ Cannot list {d}: {e}")
+    return found
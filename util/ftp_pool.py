@@ -0,0 +1,207 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from ftplib import error_perm
+
+
+class FTP_session_pool:
+    """
+    Bounded pool of logged-in FTP/FTPS sessions that are health-checked and reused.
+
+    `connect` is a function returning a new logged-in session. At most `max_size`
+    sessions exist at once; `acquire` blocks until one is free. Sessions idle for more
+    than `check_after_idle` seconds are checked with NOOP before reuse, and a session
+    is closed instead of reused after `max_uses` acquisitions or `max_age` seconds.
+    """
+
+    def __init__(self, connect, max_size=4, check_after_idle=30, max_uses=None, max_age=None):
+        self.connect = connect
+        self.max_size = max_size
+        self.check_after_idle = check_after_idle
+        self.max_uses = max_uses
+        self.max_age = max_age
+
+        self._idle = []  # sessions ready for reuse, most recently used last
+        self._info = {}  # id(session) -> {"created", "last_used", "uses", "cwd"}
+        self._open = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Return a healthy session, reusing an idle one or connecting a new one"""
+        while True:
+            with self._cond:
+                while not self._idle and self._open >= self.max_size:
+                    self._cond.wait()
+                if self._idle:
+                    ftp = self._idle.pop()
+                else:
+                    self._open += 1
+                    ftp = None
+
+            if ftp is None:
+                try:
+                    ftp = self.connect()
+                    if ftp is None:
+                        raise ConnectionError("FTP connect returned no session")
+                except Exception:
+                    self._forget(None)
+                    raise
+                now = time.time()
+                self._info[id(ftp)] = {"created": now, "last_used": now, "uses": 0, "cwd": None}
+                return ftp
+
+            if self._is_healthy(ftp):
+                return ftp
+            self._close(ftp)
+
+    def release(self, ftp, discard=False):
+        """Return a session to the pool, or close it if it is broken or has reached its limits"""
+        info = self._info.get(id(ftp))
+        if info is None:
+            return
+        info["uses"] += 1
+        info["last_used"] = time.time()
+
+        if discard or self._expired(info):
+            self._close(ftp)
+            return
+        with self._cond:
+            self._idle.append(ftp)
+            self._cond.notify()
+
+    @contextmanager
+    def session(self):
+        """
+        Borrow a session for a `with` block. The session is discarded if the block fails
+        with anything but a permanent FTP reply (e.g. 550), which leaves the connection usable.
+        """
+        ftp = self.acquire()
+        try:
+            yield ftp
+        except error_perm:
+            self.release(ftp)
+            raise
+        except BaseException:
+            self.release(ftp, discard=True)
+            raise
+        else:
+            self.release(ftp)
+
+    def chdir(self, ftp, path):
+        """cwd to an absolute path, skipping the round trip if the session is already there"""
+        info = self._info.get(id(ftp))
+        if info is not None and info["cwd"] == path:
+            return
+        ftp.cwd(path)
+        if info is not None:
+            info["cwd"] = path
+
+    def close_all(self):
+        """Close every idle session; sessions in use are closed when released"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for ftp in idle:
+            self._close(ftp)
+
+    def stats(self):
+        with self._cond:
+            return {"open": self._open, "idle": len(self._idle), "max": self.max_size}
+
+    def _expired(self, info):
+        if self.max_uses is not None and info["uses"] >= self.max_uses:
+            return True
+        if self.max_age is not None and time.time() - info["created"] >= self.max_age:
+            return True
+        return False
+
+    def _is_healthy(self, ftp):
+        info = self._info.get(id(ftp))
+        if info is None or self._expired(info):
+            return False
+        if time.time() - info["last_used"] < self.check_after_idle:
+            return True
+        try:
+            ftp.voidcmd("NOOP")
+            return True
+        except Exception:
+            return False
+
+    def _close(self, ftp):
+        try:
+            ftp.quit()
+        except Exception:
+            try:
+                ftp.close()
+            except Exception:
+                pass
+        self._forget(ftp)
+
+    def _forget(self, ftp):
+        with self._cond:
+            if ftp is not None:
+                self._info.pop(id(ftp), None)
+            self._open -= 1
+            self._cond.notify()
+
+    def __repr__(self):
+        stats = self.stats()
+        return f"FTP_session_pool(open={stats['open']}, idle={stats['idle']}, max={stats['max']})"
+
+
+def remote_size(ftp, filename):
+    """Size of a remote file from SIZE, or None if the server does not support it"""
+    try:
+        ftp.voidcmd("TYPE I")  # SIZE is only reliable in binary mode
+        size = ftp.size(filename)
+        return int(size) if size is not None else None
+    except error_perm as e:
+        if str(e)[:3] in ("500", "502", "504"):
+            return None
+        raise
+
+
+def retr_resumable(ftp, filename, local_file, expected_size=None, digest=None):
+    """
+    Download `filename` from the current directory to `local_file`, resumably.
+
+    Bytes are written to `local_file.part`, which is kept when the transfer fails; the
+    next call continues after the bytes already there with REST. The file is checked
+    against `expected_size` (or the remote SIZE when not given) and only renamed to
+    `local_file` once complete. Raises IOError if the size does not match.
+
+    A hashlib `digest` (e.g. hashlib.md5()) is fed the whole file while it is written: the
+    bytes of a resumed .part file are read back first, the rest as it arrives.
+
+    Returns:
+        int: number of bytes transferred by this call.
+    """
+    part_file = f"{local_file}.part"
+    if expected_size is None:
+        expected_size = remote_size(ftp, filename)
+
+    offset = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+    if expected_size is not None and offset > expected_size:
+        offset = 0  # Longer than the remote file: the remote file was replaced, start over
+
+    if digest is not None and offset:
+        with open(part_file, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+
+    transferred = 0
+    if expected_size is None or offset < expected_size:
+        with open(part_file, "ab" if offset else "wb") as f:
+            def write(block):
+                nonlocal transferred
+                f.write(block)
+                if digest is not None:
+                    digest.update(block)
+                transferred += len(block)
+            ftp.retrbinary(f"RETR {filename}", write, rest=offset or None)
+
+    size = os.path.getsize(part_file)
+    if expected_size is not None and size != expected_size:
+        raise IOError(f"incomplete download of {filename}: {size} of {expected_size} bytes")
+    os.replace(part_file, local_file)
+    return transferred
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import rasterio
+
+# Station list shared by the AOD, IMERG and MODIS station extraction (same station ids everywhere)
+STATIONS_FILE = "/home/work1/projects/Air_Quality/AOD data/vietnam_meteostat_stations.csv"
+
+_stations_cache = {}
+_pixel_index_cache = {}
+
+
+def load_stations(path=STATIONS_FILE):
+    """Đọc danh sách trạm (Read the station list): station_id, station_name, latitude, longitude"""
+    stations = pd.read_csv(path)
+    stations = stations.rename(columns={"name": "station_name"})
+
+    if "station_id" not in stations.columns:
+        stations["station_id"] = range(len(stations))
+    return stations
+
+
+def get_stations(path=STATIONS_FILE):
+    """Station list, read once per process"""
+    if path not in _stations_cache:
+        _stations_cache[path] = load_stations(path)
+    return _stations_cache[path]
+
+
+def station_pixel_indices(transform, shape, lons, lats):
+    """
+    Row/col of every station on a raster grid, computed once per grid and station set.
+
+    Returns:
+        tuple: (rows, cols, inside) arrays; `inside` is False for stations outside the grid.
+    """
+    lons = np.asarray(lons, dtype="float64")
+    lats = np.asarray(lats, dtype="float64")
+    key = (tuple(transform)[:6], tuple(shape), hash(lons.tobytes() + lats.tobytes()))
+    if key not in _pixel_index_cache:
+        # Giống src.index(): làm tròn xuống (floor)
+        rows, cols = rasterio.transform.rowcol(transform, lons, lats)
+        rows = np.asarray(rows, dtype="int64").reshape(-1)
+        cols = np.asarray(cols, dtype="int64").reshape(-1)
+        inside = (rows >= 0) & (rows < shape[0]) & (cols >= 0) & (cols < shape[1])
+        _pixel_index_cache[key] = (rows, cols, inside)
+    return _pixel_index_cache[key]